@@ -0,0 +1,52 @@
+"""create documents table
+
+Revision ID: 1a7d3c5e9f20
+Revises:
+Create Date: 2026-10-15 08:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1a7d3c5e9f20'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Single-column indexes declared with index=True on the original model
+INDEXED_COLUMNS = ['filename', 'case_id', 'visa_type', 'category', 'document_type']
+
+
+def upgrade() -> None:
+    # Databases set up by Base.metadata.create_all (CREATE_TABLES_ON_STARTUP)
+    # already have the table; online runs adopt it as is
+    if not op.get_context().as_sql and sa.inspect(op.get_bind()).has_table('documents'):
+        return
+
+    op.create_table(
+        'documents',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('filename', sa.String(), nullable=True),
+        sa.Column('s3_url', sa.String(), nullable=True),
+        sa.Column('case_id', sa.String(), nullable=True),
+        sa.Column('visa_type', sa.String(), nullable=True),
+        sa.Column('category', sa.String(), nullable=True),
+        sa.Column('extracted_text', sa.Text(), nullable=True),
+        sa.Column('uploaded_at', sa.DateTime(), nullable=True),
+        sa.Column('document_metadata', sa.JSON(), nullable=True),
+        sa.Column('document_type', sa.String(), nullable=True),
+        sa.Column('relevant_sections', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    for column in INDEXED_COLUMNS:
+        op.create_index(op.f(f'ix_documents_{column}'), 'documents', [column])
+
+
+def downgrade() -> None:
+    for column in reversed(INDEXED_COLUMNS):
+        op.drop_index(op.f(f'ix_documents_{column}'), table_name='documents')
+    op.drop_table('documents')
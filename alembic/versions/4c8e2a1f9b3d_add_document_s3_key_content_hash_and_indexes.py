@@ -0,0 +1,76 @@
+"""add document s3_key, content_sha256 and list indexes
+
+Revision ID: 4c8e2a1f9b3d
+Revises: 1a7d3c5e9f20
+Create Date: 2026-10-15 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8e2a1f9b3d'
+down_revision: Union[str, None] = '1a7d3c5e9f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Tables created by Base.metadata.create_all (CREATE_TABLES_ON_STARTUP) after
+# these columns existed already have them, so online runs skip what exists;
+# offline (--sql) scripts assume a table that predates them
+NEW_COLUMNS = [
+    sa.Column('s3_key', sa.String(), nullable=True),
+    sa.Column('content_sha256', sa.String(length=64), nullable=True),
+]
+
+NEW_INDEXES = [
+    ('ix_documents_s3_key', ['s3_key']),
+    ('ix_documents_case_id_uploaded_at', ['case_id', 'uploaded_at']),
+    ('ix_documents_case_id_visa_type_uploaded_at', ['case_id', 'visa_type', 'uploaded_at']),
+    ('ix_documents_uploaded_at', ['uploaded_at']),
+    ('ix_documents_case_id_content_sha256', ['case_id', 'content_sha256']),
+]
+
+# Uploads stored s3_url as https://<bucket>.s3.amazonaws.com/<key>
+S3_URL_HOST_SUFFIX = '.s3.amazonaws.com/'
+
+
+def _existing(kind: str) -> set:
+    """Names of the documents table's columns or indexes, or nothing when generating SQL offline"""
+    if op.get_context().as_sql:
+        return set()
+    inspector = sa.inspect(op.get_bind())
+    if kind == 'columns':
+        return {column['name'] for column in inspector.get_columns('documents')}
+    return {index['name'] for index in inspector.get_indexes('documents')}
+
+
+def upgrade() -> None:
+    columns = _existing('columns')
+    for column in NEW_COLUMNS:
+        if column.name not in columns:
+            op.add_column('documents', column)
+
+    # Backfill object keys for rows uploaded before s3_key existed, parsing them
+    # from the URL the same way main.document_s3_key does
+    op.execute(
+        sa.text(
+            "UPDATE documents "
+            "SET s3_key = substr(s3_url, strpos(s3_url, :suffix) + length(:suffix)) "
+            "WHERE s3_key IS NULL AND strpos(s3_url, :suffix) > 0"
+        ).bindparams(suffix=S3_URL_HOST_SUFFIX)
+    )
+
+    indexes = _existing('indexes')
+    for name, index_columns in NEW_INDEXES:
+        if name not in indexes:
+            op.create_index(name, 'documents', index_columns)
+
+
+def downgrade() -> None:
+    for name, _ in reversed(NEW_INDEXES):
+        op.drop_index(name, table_name='documents')
+    for column in reversed(NEW_COLUMNS):
+        op.drop_column('documents', column.name)
@@ -1,13 +1,27 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from typing import Optional
 
 class Settings(BaseSettings):
     DATABASE_URL: str
-    AWS_ACCESS_KEY: str
-    AWS_SECRET_ACCESS_KEY: str
+    # Optional: when unset, boto3 falls back to its default credential chain
+    # (AWS_PROFILE, standard env vars, container or instance roles)
+    AWS_ACCESS_KEY: Optional[str] = None
+    AWS_SECRET_ACCESS_KEY: Optional[str] = None
     S3_BUCKET_NAME: str
     OPENAI_API_KEY: Optional[str] = None  # Add this line
+    CREATE_TABLES_ON_STARTUP: bool = True
     class Config:
         env_file = ".env"
 
-settings = Settings()
\ No newline at end of file
+@lru_cache()
+def get_settings() -> Settings:
+    """Load settings (env vars and .env) once, on first use"""
+    return Settings()
+
+class _LazySettings:
+    """Proxy that defers reading and validating settings until an attribute is accessed"""
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+settings = _LazySettings()
@@ -1,11 +1,119 @@
 """
 Atomic memory management for letter generation
 """
+import functools
+import itertools
 import logging
-from typing import Dict, List, Any, Optional, Set
+import re
+from typing import Dict, List, Any, Optional, Set, FrozenSet, Pattern, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Keyword stems used to map text onto template parts
+_PART_KEYWORDS = {
+    # Original mappings
+    "education": ["degree", "university", "education", "academic", "study"],
+    "skills": ["skill", "expertise", "proficient", "knowledge", "ability"],
+    "certifications": ["certif", "license", "credential", "qualification"],
+    "work_history": ["work", "job", "position", "employed", "career"],
+    "achievements": ["achieve", "accomplish", "success", "award", "recognition"],
+    "impact": ["impact", "contribut", "influence", "effect", "result"],
+    "credentials": ["credential", "qualification", "background", "expert"],
+    "evaluation": ["evaluat", "assess", "review", "analysis"],
+    "recommendation": ["recommend", "endorse", "support", "advocate"],
+    
+    # New mappings for visa-specific sections
+    "opening": ["write", "support", "petition", "behalf"],
+    "applicant_intro": ["applicant", "field", "background", "introduce"],
+    "awards": ["award", "prize", "medal", "honor", "grant"],
+    "recognition": ["recognized", "acknowledged", "distinguished", "reputation"],
+    "contributions": ["contribut", "develop", "research", "advance", "innovat"],
+    "merit": ["merit", "importance", "significant", "substantial", "value"],
+    "positioning": ["position", "advance", "qualification", "background", "unique"],
+    "waiver_justification": ["waiver", "benefit", "interest", "advantage", "important"],
+    "summary": ["summary", "conclude", "therefore", "thus", "finally"],
+}
+
+# Template placeholders of the form {{field_name}}
+_PLACEHOLDER_RE = re.compile(r"\{\{([^{}]*)\}\}")
+
+# Each part gets a small integer ID so a set of parts is a bitmask
+_PART_NAMES = list(_PART_KEYWORDS)
+_PART_ID = {part: i for i, part in enumerate(_PART_NAMES)}
+
+# Inverted index: keyword stem -> bitmask of the parts that reference it
+_KEYWORD_BITS: Dict[str, int] = {}
+for _part, _part_keywords in _PART_KEYWORDS.items():
+    for _keyword in _part_keywords:
+        _KEYWORD_BITS[_keyword] = _KEYWORD_BITS.get(_keyword, 0) | (1 << _PART_ID[_part])
+del _part, _part_keywords, _keyword
+
+
+def _parts_from_bits(bits: int) -> List[str]:
+    """Expand a part bitmask back into part names"""
+    parts = []
+    while bits:
+        lowest = bits & -bits
+        parts.append(_PART_NAMES[lowest.bit_length() - 1])
+        bits ^= lowest
+    return parts
+
+
+@functools.lru_cache(maxsize=None)
+def _section_matcher(parts: Tuple[str, ...]) -> Tuple[Optional[Pattern], Dict[str, int], int]:
+    """
+    Compile a single regex over every keyword stem of the given template parts
+
+    Returns the pattern, a map from matched stem to the bitmask of parts it
+    implies, and the bitmask of all parts that can match at all.
+    """
+    section_bits = 0
+    for part in parts:
+        if part in _PART_ID:
+            section_bits |= 1 << _PART_ID[part]
+    keyword_bits = {}
+    for keyword, bits in _KEYWORD_BITS.items():
+        if bits & section_bits:
+            keyword_bits[keyword] = bits & section_bits
+    if not keyword_bits:
+        return None, {}, 0
+
+    # The lookahead captures one stem per position (longest first), so a match
+    # must also imply the parts of any shorter stem that is its prefix
+    for keyword in keyword_bits:
+        for other, other_bits in keyword_bits.items():
+            if other != keyword and keyword.startswith(other):
+                keyword_bits[keyword] |= other_bits
+
+    alternation = "|".join(re.escape(k) for k in sorted(keyword_bits, key=len, reverse=True))
+    reachable_bits = 0
+    for bits in keyword_bits.values():
+        reachable_bits |= bits
+    return re.compile(f"(?=({alternation}))"), keyword_bits, reachable_bits
+
+
+def _match_parts(text: str, matcher: Tuple[Optional[Pattern], Dict[str, int], int]) -> int:
+    """Return the bitmask of parts whose keywords occur in the (lowercased) text"""
+    pattern, keyword_bits, reachable_bits = matcher
+    hits = 0
+    if pattern is None:
+        return hits
+    for match in pattern.finditer(text):
+        hits |= keyword_bits[match.group(1)]
+        # Stop scanning as soon as every part of the section has been hit
+        if hits == reachable_bits:
+            break
+    return hits
+
+
+@functools.lru_cache(maxsize=4096)
+def _classify_text(parts: Tuple[str, ...], text: str) -> Tuple[str, ...]:
+    """Memoized text -> matched parts; the same chunk is often mapped by several sections and passes"""
+    # Lowercase once and match case-sensitively: with re.IGNORECASE, Unicode case
+    # folding can match text (e.g. "ſtudy") whose lowercase form is not a stem
+    return tuple(_parts_from_bits(_match_parts(text.lower(), _section_matcher(parts))))
+
+
 class AtomicMemory:
     """
     Manages atomic memory units for letter generation with source traceability
@@ -43,8 +151,10 @@ class AtomicMemory:
         
         # Content storage - separate from section definitions
         self.content = {}
-        self.source_content_mapping = {}  # Maps section.field to source chunks
-        self.letter_refs_mapping = {}     # Maps section.field to letter references
+        self.source_content_mapping = {}  # Maps section -> field -> source chunks
+        self.letter_refs_mapping = {}     # Maps section -> field -> letter references
+        self._flat_content = None         # Cached field -> content view of self.content
+        self._letter_ids_by_key = {}      # Maps (section, field) to the letter IDs of its references
         
     def _initialize_visa_sections(self):
         """Initialize visa-specific sections"""
@@ -93,40 +203,12 @@ class AtomicMemory:
         section = self.sections[section_name]
         mapping = {part: [] for part in section["template_parts"]}
        
-        # Simple keyword-based mapping
-        keywords = {
-            # Original mappings
-            "education": ["degree", "university", "education", "academic", "study"],
-            "skills": ["skill", "expertise", "proficient", "knowledge", "ability"],
-            "certifications": ["certif", "license", "credential", "qualification"],
-            "work_history": ["work", "job", "position", "employed", "career"],
-            "achievements": ["achieve", "accomplish", "success", "award", "recognition"],
-            "impact": ["impact", "contribut", "influence", "effect", "result"],
-            "credentials": ["credential", "qualification", "background", "expert"],
-            "evaluation": ["evaluat", "assess", "review", "analysis"],
-            "recommendation": ["recommend", "endorse", "support", "advocate"],
-            
-            # New mappings for visa-specific sections
-            "opening": ["write", "support", "petition", "behalf"],
-            "applicant_intro": ["applicant", "field", "background", "introduce"],
-            "awards": ["award", "prize", "medal", "honor", "grant"],
-            "recognition": ["recognized", "acknowledged", "distinguished", "reputation"],
-            "contributions": ["contribut", "develop", "research", "advance", "innovat"],
-            "merit": ["merit", "importance", "significant", "substantial", "value"],
-            "positioning": ["position", "advance", "qualification", "background", "unique"],
-            "waiver_justification": ["waiver", "benefit", "interest", "advantage", "important"],
-            "summary": ["summary", "conclude", "therefore", "thus", "finally"],
-        }
+        parts = tuple(section["template_parts"])
        
         # Map chunks to parts based on keyword matches
         for chunk in chunks:
-            text = chunk["text"].lower()
-            for part, part_keywords in keywords.items():
-                if part in mapping:
-                    for keyword in part_keywords:
-                        if keyword in text:
-                            mapping[part].append(chunk)
-                            break
+            for part in _classify_text(parts, chunk["text"]):
+                mapping[part].append(chunk)
        
         # Ensure every part has at least one chunk
         for part in mapping:
@@ -147,39 +229,12 @@ class AtomicMemory:
         mapping = {part: [] for part in section["template_parts"]}
         
         # Use the same keyword mapping as for chunks
-        keywords = {
-            # Original mappings
-            "education": ["degree", "university", "education", "academic", "study"],
-            "skills": ["skill", "expertise", "proficient", "knowledge", "ability"],
-            "certifications": ["certif", "license", "credential", "qualification"],
-            "work_history": ["work", "job", "position", "employed", "career"],
-            "achievements": ["achieve", "accomplish", "success", "award", "recognition"],
-            "impact": ["impact", "contribut", "influence", "effect", "result"],
-            "credentials": ["credential", "qualification", "background", "expert"],
-            "evaluation": ["evaluat", "assess", "review", "analysis"],
-            "recommendation": ["recommend", "endorse", "support", "advocate"],
-            
-            # New mappings for visa-specific sections
-            "opening": ["write", "support", "petition", "behalf"],
-            "applicant_intro": ["applicant", "field", "background", "introduce"],
-            "awards": ["award", "prize", "medal", "honor", "grant"],
-            "recognition": ["recognized", "acknowledged", "distinguished", "reputation"],
-            "contributions": ["contribut", "develop", "research", "advance", "innovat"],
-            "merit": ["merit", "importance", "significant", "substantial", "value"],
-            "positioning": ["position", "advance", "qualification", "background", "unique"],
-            "waiver_justification": ["waiver", "benefit", "interest", "advantage", "important"],
-            "summary": ["summary", "conclude", "therefore", "thus", "finally"],
-        }
+        parts = tuple(section["template_parts"])
         
         # Map letter examples to parts based on keyword matches
         for example in letter_examples:
-            text = example.get("text", "").lower()
-            for part, part_keywords in keywords.items():
-                if part in mapping:
-                    for keyword in part_keywords:
-                        if keyword in text:
-                            mapping[part].append(example)
-                            break
+            for part in _classify_text(parts, example.get("text", "")):
+                mapping[part].append(example)
         
         # Store the mapping in the section
         self.sections[section_name]["letter_refs"] = mapping
@@ -204,16 +259,17 @@ class AtomicMemory:
         
         # Store content
         self.content[section_name][field_name] = content
+        self._flat_content = None
         
         # Track source chunks if provided
         if source_chunks:
-            key = f"{section_name}.{field_name}"
-            self.source_content_mapping[key] = source_chunks
+            self.source_content_mapping.setdefault(section_name, {})[field_name] = source_chunks
         
         # Track letter references if provided
         if letter_refs:
-            key = f"{section_name}.{field_name}"
-            self.letter_refs_mapping[key] = letter_refs
+            self.letter_refs_mapping.setdefault(section_name, {})[field_name] = letter_refs
+            letter_ids = (ref.get("metadata", {}).get("letter_id") for ref in letter_refs)
+            self._letter_ids_by_key[(section_name, field_name)] = frozenset(filter(None, letter_ids))
     
     def get_section_data(self, section_name: str, field_name: Optional[str] = None):
         """Get data for a section or specific field"""
@@ -231,67 +287,62 @@ class AtomicMemory:
     
     def get_sources(self, section_name: str, field_name: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get source chunks for a section or field"""
+        section_sources = self.source_content_mapping.get(section_name, {})
         if field_name:
-            key = f"{section_name}.{field_name}"
-            return self.source_content_mapping.get(key, [])
+            return section_sources.get(field_name, [])
             
         # Return all sources for all fields in the section
-        sources = []
-        for key, chunks in self.source_content_mapping.items():
-            if key.startswith(f"{section_name}."):
-                sources.extend(chunks)
-        return sources
+        return list(itertools.chain.from_iterable(section_sources.values()))
     
     def get_letter_references(self, section_name: str, field_name: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get referenced letter examples for a section or field"""
+        section_refs = self.letter_refs_mapping.get(section_name, {})
         if field_name:
-            key = f"{section_name}.{field_name}"
-            return self.letter_refs_mapping.get(key, [])
+            return section_refs.get(field_name, [])
             
         # Return all letter references for all fields in the section
-        refs = []
-        for key, letters in self.letter_refs_mapping.items():
-            if key.startswith(f"{section_name}."):
-                refs.extend(letters)
-        return refs
+        return list(itertools.chain.from_iterable(section_refs.values()))
     
     def fill_template(self, template: str, additional_fields: Optional[Dict[str, str]] = None) -> str:
         """Fill a template with data from all sections"""
-        # Flatten all section data
-        data = {}
-        for section, fields in self.content.items():
-            data.update(fields)
-            
-        # Add any additional fields
-        if additional_fields:
-            data.update(additional_fields)
-            
-        # Replace placeholders in template
-        result = template
-        for key, value in data.items():
-            placeholder = "{{" + key + "}}"
-            result = result.replace(placeholder, str(value))
+        # Flatten all section data once per change to the content
+        if self._flat_content is None:
+            self._flat_content = {}
+            for section, fields in self.content.items():
+                self._flat_content.update(fields)
+        data = self._flat_content
+        extra = additional_fields or {}
             
-        return result
+        # Replace all placeholders in a single pass; additional fields take precedence
+        # and unknown placeholders are left untouched
+        def substitute(match):
+            key = match.group(1)
+            if key in extra:
+                return str(extra[key])
+            return str(data[key]) if key in data else match.group(0)
+        
+        return _PLACEHOLDER_RE.sub(substitute, template)
     
     def get_all_data(self) -> Dict[str, Dict[str, str]]:
         """Get all data from all sections"""
         return self.content.copy()
     
     def get_all_sources(self) -> Dict[str, List[Dict[str, Any]]]:
-        """Get all source mappings"""
-        return self.source_content_mapping.copy()
+        """Get all source mappings, keyed by section.field"""
+        return {
+            f"{section}.{field}": chunks
+            for section, fields in self.source_content_mapping.items()
+            for field, chunks in fields.items()
+        }
     
     def get_all_letter_refs(self) -> Dict[str, List[Dict[str, Any]]]:
-        """Get all letter references"""
-        return self.letter_refs_mapping.copy()
+        """Get all letter references, keyed by section.field"""
+        return {
+            f"{section}.{field}": refs
+            for section, fields in self.letter_refs_mapping.items()
+            for field, refs in fields.items()
+        }
     
     def get_referenced_letter_ids(self) -> Set[str]:
         """Get all unique letter IDs referenced in this memory"""
-        letter_ids = set()
-        for refs in self.letter_refs_mapping.values():
-            for ref in refs:
-                letter_id = ref.get("metadata", {}).get("letter_id")
-                if letter_id:
-                    letter_ids.add(letter_id)
-        return letter_ids
\ No newline at end of file
+        return set().union(*self._letter_ids_by_key.values())
\ No newline at end of file
@@ -3,7 +3,7 @@ Case-specific context and retrieval for KET-RAG
 """
 import logging
 from typing import List, Dict, Any
-from sklearn.metrics.pairwise import cosine_similarity
+from app.ket_rag.core import top_k_indices
 
 logger = logging.getLogger(__name__)
 
@@ -16,55 +16,65 @@ class CaseContext:
         """Initialize with a KETRAG instance and case ID"""
         self.ket_rag = ket_rag
         self.case_id = case_id
+        self._case_embeddings = None  # normalized embeddings of this case's chunks
+        self._case_embeddings_key = None  # (embeddings_version, chunk count) they were gathered at
         logger.info(f"Created case context for case: {case_id}")
     
     def retrieve_for_case(self, query: str, top_k: int = 5):
         """Retrieve documents for a specific case only"""
-        # Get query embedding
-        query_embedding = self.ket_rag.embedding_model.encode([query])[0]
-        
-        # Filter chunks by case_id first
-        case_chunk_indices = [i for i, chunk in enumerate(self.ket_rag.chunks) 
-                            if chunk["metadata"].get("case_id") == self.case_id]
+        return self.retrieve_batch_for_case([query], top_k=top_k)[0]
+    
+    def retrieve_batch_for_case(self, queries: List[str], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Retrieve documents for several queries within this case, embedding all queries at once"""
+        # Look up this case's chunks in the case index
+        case_chunk_indices = self.ket_rag.get_case_chunk_indices(self.case_id)
         
         if not case_chunk_indices:
             logger.warning(f"No chunks found for case: {self.case_id}")
+            return [[] for _ in queries]
+        if not queries:
             return []
         
-        # Get embeddings for only the filtered chunks
-        case_embeddings = self.ket_rag.chunk_embeddings[case_chunk_indices]
-        
-        # Calculate similarity
-        similarities = cosine_similarity([query_embedding], case_embeddings)[0]
+        # Get normalized embeddings for only the filtered chunks
+        case_embeddings = self._get_case_embeddings(case_chunk_indices)
         
-        # Get top results
-        top_indices = similarities.argsort()[-top_k:][::-1]
+        # Calculate cosine similarity for every query in one matrix product
+        similarities = self.ket_rag.encode_queries(queries) @ case_embeddings.T
         
-        # Map back to original indices
-        original_indices = [case_chunk_indices[i] for i in top_indices]
-        
-        # Return results
-        results = []
-        for idx in original_indices:
-            results.append({
-                'chunk_idx': idx,
-                'text': self.ket_rag.chunks[idx]["text"],
-                'metadata': self.ket_rag.chunks[idx]["metadata"],
-                'score': float(similarities[top_indices[original_indices.index(idx)]])
-            })
+        batch_results = []
+        for query_similarities in similarities:
+            # Return results, mapping case-local positions back to original indices
+            results = []
+            for local_idx in top_k_indices(query_similarities, top_k):
+                idx = case_chunk_indices[local_idx]
+                results.append({
+                    'chunk_idx': idx,
+                    'text': self.ket_rag.chunks[idx]["text"],
+                    'metadata': self.ket_rag.chunks[idx]["metadata"],
+                    'score': float(query_similarities[local_idx])
+                })
+            batch_results.append(results)
         
-        return results
+        return batch_results
+    
+    def _get_case_embeddings(self, case_chunk_indices: List[int]):
+        """Gather this case's normalized embeddings, reusing them until the corpus embeddings change"""
+        key = (self.ket_rag.embeddings_version, len(case_chunk_indices))
+        if self._case_embeddings is None or self._case_embeddings_key != key:
+            self._case_embeddings = self.ket_rag.normalized_embeddings[case_chunk_indices]
+            self._case_embeddings_key = key
+        return self._case_embeddings
     
     def get_all_case_chunks(self):
         """Get all chunks for this case"""
         case_chunks = []
-        for i, chunk in enumerate(self.ket_rag.chunks):
-            if chunk["metadata"].get("case_id") == self.case_id:
-                case_chunks.append({
-                    'chunk_idx': i,
-                    'text': chunk["text"],
-                    'metadata': chunk["metadata"]
-                })
+        for i in self.ket_rag.get_case_chunk_indices(self.case_id):
+            chunk = self.ket_rag.chunks[i]
+            case_chunks.append({
+                'chunk_idx': i,
+                'text': chunk["text"],
+                'metadata': chunk["metadata"]
+            })
         return case_chunks
     
     def get_case_metadata(self):
@@ -3,18 +3,77 @@ KET-RAG: Knowledge-Enhanced Two-layer Retrieval Augmented Generation
 Core implementation for immigration document system
 """
 
+import asyncio
+import functools
 import logging
+import sys
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable
 import networkx as nx
+import torch
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import spacy
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=4)
+def get_nlp(model_name: str = "en_core_web_sm"):
+    """
+    Process-wide spaCy pipeline for keyword extraction
+    
+    Only POS tags and lemmas are used, so the dependency parser and NER are disabled.
+    """
+    logger.info(f"Loading spaCy pipeline {model_name}")
+    return spacy.load(model_name, disable=["parser", "ner"])
+
+@functools.lru_cache(maxsize=4)
+def get_embedding_model(model_name: str, device: Optional[str] = None) -> SentenceTransformer:
+    """Process-wide SentenceTransformer, shared by all KETRAG instances (read-only at inference)"""
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    logger.info(f"Loading embedding model {model_name} on {device}")
+    model = SentenceTransformer(model_name, device=device)
+    if device.startswith("cuda"):
+        # Half precision halves memory traffic and uses tensor cores; outputs are
+        # still stored as float32 in the embedding buffer
+        model.half()
+    # Run one tiny batch so tokenizer setup and first-call kernel initialization
+    # are paid at load time rather than by the first real query
+    model.encode(["warmup"], convert_to_numpy=True)
+    return model
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """Row-wise L2 normalization (zero rows are left as-is, like sklearn)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+# Distinct query strings whose embeddings are memoized per KETRAG instance
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+# Low-cardinality metadata fields repeated across many documents; their string
+# values are interned so all chunks share one object per distinct value
+INTERNED_METADATA_KEYS = ("case_id", "visa_type", "category", "document_type", "profession", "section_id")
+
+def intern_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of metadata with the INTERNED_METADATA_KEYS string values interned"""
+    metadata = dict(metadata)
+    for key in INTERNED_METADATA_KEYS:
+        value = metadata.get(key)
+        if type(value) is str:
+            metadata[key] = sys.intern(value)
+    return metadata
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k highest scores in descending order, via O(N) partial selection"""
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(scores, -top_k)[-top_k:]
+    return candidates[np.argsort(-scores[candidates])]
+
 class KETRAG:
     """
     Knowledge-Enhanced Two-layer Retrieval Augmented Generation
@@ -25,10 +84,21 @@ class KETRAG:
     3. Creating a keyword-chunk bipartite graph for efficient retrieval
     """
     
-    def __init__(self, embedding_model_name="all-MiniLM-L6-v2"):
-        """Initialize the KET-RAG system"""
-        self.nlp = spacy.load("en_core_web_sm")
-        self.embedding_model = SentenceTransformer(embedding_model_name)
+    def __init__(self, embedding_model_name="all-MiniLM-L6-v2", device: Optional[str] = None):
+        """
+        Initialize the KET-RAG system
+        
+        Args:
+            embedding_model_name: SentenceTransformer model to embed chunks and queries
+            device: Torch device for the embedding model (defaults to CUDA when available)
+        """
+        self._nlp = None  # spaCy pipeline, loaded on first use (see nlp)
+        # The model itself is never pickled; loading restores the shared instance by name
+        self._embedding_model_name = embedding_model_name
+        self._embedding_device = device
+        self.embedding_model = get_embedding_model(embedding_model_name, device)
+        # Memoized single-query embeddings, keyed on the raw query string
+        self._embed_query = functools.lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(self._encode_query)
         
         # Knowledge Graph Skeleton (Layer 1)
         self.knowledge_graph = nx.DiGraph()
@@ -38,7 +108,22 @@ class KETRAG:
         
         # Storage for chunks and embeddings
         self.chunks = []  # List of {text: str, metadata: Dict}
-        self.chunk_embeddings = []  # Numpy array of embeddings
+        # Embeddings live in a preallocated float32 buffer that grows geometrically;
+        # only the first _n_embeddings rows are populated (see chunk_embeddings).
+        # A parallel buffer holds the L2-normalized rows used for cosine scoring.
+        dim = self.embedding_model.get_sentence_embedding_dimension()
+        self._embedding_buffer = np.empty((0, dim), dtype=np.float32)
+        self._normalized_buffer = np.empty((0, dim), dtype=np.float32)
+        self._n_embeddings = 0
+        # Bumped whenever the embeddings change, so derived caches (e.g. a
+        # CaseContext's gathered rows) can tell they are stale
+        self._embeddings_version = 0
+        
+        # Inverted index of case_id -> positions in self.chunks
+        self._case_index: Dict[Any, List[int]] = {}
+        
+        # Column-wise (struct-of-arrays) views of chunk metadata, built on demand
+        self._metadata_columns: Dict[str, np.ndarray] = {}
         
         # Immigration-specific vocabulary
         self.immigration_keywords = {
@@ -48,33 +133,160 @@ class KETRAG:
                    "substantial merit", "labor certification"]
         }
     
+    @property
+    def nlp(self):
+        """spaCy pipeline for keyword extraction, loaded lazily and shared across instances"""
+        if self._nlp is None:
+            self._nlp = get_nlp()
+        return self._nlp
+    
+    @property
+    def chunk_embeddings(self) -> np.ndarray:
+        """Populated rows of the embedding buffer, one per chunk"""
+        return self._embedding_buffer[:self._n_embeddings]
+    
+    @property
+    def normalized_embeddings(self) -> np.ndarray:
+        """L2-normalized chunk embeddings; a dot product with a unit query is the cosine similarity"""
+        return self._normalized_buffer[:self._n_embeddings]
+    
+    @property
+    def embeddings_version(self) -> int:
+        """Counter that changes every time chunk embeddings are added or replaced"""
+        return self._embeddings_version
+    
+    @chunk_embeddings.setter
+    def chunk_embeddings(self, embeddings) -> None:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.size == 0:
+            embeddings = embeddings.reshape(0, 0)  # e.g. the old empty-list default
+        self._embedding_buffer = np.ascontiguousarray(np.atleast_2d(embeddings))
+        self._normalized_buffer = l2_normalize(self._embedding_buffer)
+        self._n_embeddings = len(embeddings)
+        self._embeddings_version += 1
+    
+    def _append_embeddings(self, embeddings: np.ndarray) -> None:
+        """Copy new rows into the buffer, doubling its capacity when full"""
+        needed = self._n_embeddings + len(embeddings)
+        if needed > len(self._embedding_buffer):
+            capacity = max(2 * len(self._embedding_buffer), needed)
+            buffer = np.empty((capacity, embeddings.shape[1]), dtype=np.float32)
+            normalized = np.empty((capacity, embeddings.shape[1]), dtype=np.float32)
+            if self._n_embeddings:
+                buffer[:self._n_embeddings] = self._embedding_buffer[:self._n_embeddings]
+                normalized[:self._n_embeddings] = self._normalized_buffer[:self._n_embeddings]
+            self._embedding_buffer = buffer
+            self._normalized_buffer = normalized
+        self._embedding_buffer[self._n_embeddings:needed] = embeddings
+        self._normalized_buffer[self._n_embeddings:needed] = l2_normalize(embeddings)
+        self._n_embeddings = needed
+        self._embeddings_version += 1
+    
+    def __getstate__(self):
+        # Don't persist the unused tail of the embedding buffer, nor the normalized
+        # copy, which is recomputed from the raw embeddings on load. The populated
+        # rows are a contiguous view, which protocol 5 writes straight from the
+        # buffer without an intermediate copy of the matrix
+        state = self.__dict__.copy()
+        state["_embedding_buffer"] = self.chunk_embeddings
+        del state["_normalized_buffer"]
+        # The spaCy pipeline and metadata columns are rebuilt on demand rather than
+        # pickled, and the embedding model is looked up again from its name
+        state["_nlp"] = None
+        del state["embedding_model"]
+        state["_metadata_columns"] = {}
+        # The query embedding cache wraps a bound method and is recreated on load
+        del state["_embed_query"]
+        return state
+    
+    def __setstate__(self, state):
+        # Models pickled before the buffer existed stored a plain chunk_embeddings attribute
+        legacy_embeddings = state.pop("chunk_embeddings", None)
+        state.setdefault("_nlp", state.pop("nlp", None))
+        state.setdefault("_metadata_columns", {})
+        state.setdefault("_embeddings_version", 0)
+        self.__dict__.update(state)
+        # Models pickled before the name was recorded carry their own model copy
+        if "embedding_model" not in state:
+            self.embedding_model = get_embedding_model(self._embedding_model_name, self._embedding_device)
+        self._embed_query = functools.lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(self._encode_query)
+        if legacy_embeddings is not None:
+            self.chunk_embeddings = legacy_embeddings
+        elif "_normalized_buffer" not in state:
+            self._normalized_buffer = l2_normalize(self._embedding_buffer)
+        if "_case_index" not in state:
+            self._rebuild_case_index()
+    
+    def _rebuild_case_index(self) -> None:
+        """Recompute the case_id -> chunk positions index from self.chunks"""
+        self._case_index = {}
+        for i, chunk in enumerate(self.chunks):
+            self._case_index.setdefault(chunk["metadata"].get("case_id"), []).append(i)
+    
+    def get_case_chunk_indices(self, case_id: str) -> List[int]:
+        """Positions in self.chunks of all chunks belonging to a case"""
+        return self._case_index.get(case_id, [])
+    
+    def metadata_column(self, key: str) -> np.ndarray:
+        """
+        One metadata field for every chunk as an object array (None where missing)
+        
+        Lets callers filter chunks with vectorized comparisons instead of a Python
+        loop over chunk dicts. Columns are cached and rebuilt once chunks are added.
+        """
+        column = self._metadata_columns.get(key)
+        if column is None or len(column) != len(self.chunks):
+            # Fill with one slice assignment; np.array() on the list could
+            # broadcast list/tuple values into extra dimensions
+            column = np.empty(len(self.chunks), dtype=object)
+            column[:] = [chunk["metadata"].get(key) for chunk in self.chunks]
+            self._metadata_columns[key] = column
+        return column
+    
     def process_document(self, text: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process a document with KET-RAG - simplified version for initial testing
         """
+        return self.process_documents([(text, metadata)])[0]
+    
+    def process_documents(self, documents: List[Tuple[str, Dict[str, Any]]],
+                          batch_size: int = 64) -> List[Dict[str, Any]]:
+        """
+        Process several documents at once, embedding all of their chunks in a
+        single encode call
+        """
         try:
             # 1. Simple document chunking by paragraphs
-            chunks = self._chunk_document(text, metadata)
-            chunk_texts = [chunk["text"] for chunk in chunks]
+            doc_chunks = [self._chunk_document(text, metadata) for text, metadata in documents]
+            chunk_texts = [chunk["text"] for chunks in doc_chunks for chunk in chunks]
             
-            # Store chunks
-            self.chunks.extend(chunks)
+            # Store chunks and index them by case
+            for (_, metadata), chunks in zip(documents, doc_chunks):
+                start = len(self.chunks)
+                self.chunks.extend(chunks)
+                self._case_index.setdefault(metadata.get("case_id"), []).extend(
+                    range(start, len(self.chunks)))
             
             # 2. Create embeddings
-            embeddings = self.embedding_model.encode(chunk_texts)
+            embeddings = np.asarray(
+                self.embedding_model.encode(chunk_texts, batch_size=batch_size),
+                dtype=np.float32)
             
             # Store embeddings
-            if len(self.chunk_embeddings) == 0:
-                self.chunk_embeddings = embeddings
-            else:
-                self.chunk_embeddings = np.vstack([self.chunk_embeddings, embeddings])
+            if len(embeddings):
+                self._append_embeddings(embeddings)
             
             # Return basic results for testing
-            return {
-                "chunks": chunks,
-                "embeddings": embeddings,
-                "metadata": metadata
-            }
+            results = []
+            offset = 0
+            for (_, metadata), chunks in zip(documents, doc_chunks):
+                results.append({
+                    "chunks": chunks,
+                    "embeddings": embeddings[offset:offset + len(chunks)],
+                    "metadata": metadata
+                })
+                offset += len(chunks)
+            return results
             
         except Exception as e:
             logger.error(f"Error processing document: {str(e)}")
@@ -83,59 +295,125 @@ class KETRAG:
     def _chunk_document(self, text: str, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Split document into chunks by paragraphs
+        
+        Each chunk gets its own metadata dict carrying its position; the document
+        fields are interned once and their values shared by all of its chunks.
         """
         # Split by paragraphs
         paragraphs = [p for p in text.split('\n\n') if p.strip()]
         
-        chunks = []
-        for i, para in enumerate(paragraphs):
-            chunk_metadata = {
-                **metadata,
-                "chunk_index": len(chunks),
-                "paragraph_index": i
-            }
-            chunks.append({
+        shared_metadata = intern_metadata(metadata)
+        return [
+            {
                 "text": para,
-                "metadata": chunk_metadata
-            })
+                "metadata": {**shared_metadata, "chunk_index": i, "paragraph_index": i}
+            }
+            for i, para in enumerate(paragraphs)
+        ]
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Embed queries in a single model call as L2-normalized float32 rows
         
-        return chunks
+        A lone query is served from the per-instance embedding cache, so a
+        repeated question skips the model forward pass entirely.
+        """
+        queries = list(queries)
+        if len(queries) == 1:
+            return self._embed_query(queries[0])[np.newaxis, :]
+        # One batch covering every query, so they share a single forward pass
+        embeddings = self.embedding_model.encode(
+            queries, batch_size=max(len(queries), 1), convert_to_numpy=True, normalize_embeddings=True
+        )
+        return np.asarray(embeddings, dtype=np.float32)
     
-    def retrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Embed one query; the row is read-only since it is shared through the cache"""
+        embedding = self.embedding_model.encode(
+            [query], convert_to_numpy=True, normalize_embeddings=True
+        )
+        embedding = np.array(embedding[0], dtype=np.float32)
+        embedding.flags.writeable = False
+        return embedding
+    
+    def retrieve(self, query: str, top_k: int = 3,
+                 filter_fn: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                 candidate_mask: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
         """
         Simple vector-based retrieval for initial testing
+        
+        If filter_fn is given, only chunks for which it returns True are ranked;
+        candidate_mask (a boolean array over self.chunks) restricts ranking the
+        same way without a per-chunk Python callback.
+        """
+        return self.retrieve_batch([query], top_k=top_k, filter_fn=filter_fn,
+                                   candidate_mask=candidate_mask)[0]
+    
+    async def retrieve_async(self, query: str, top_k: int = 3,
+                             filter_fn: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                             candidate_mask: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """
+        retrieve() for async callers, run in a worker thread
+        
+        The embedding forward pass and scoring stay off the event loop, so
+        retrieval can be awaited with asyncio.gather alongside other work
+        (e.g. an OpenAIClient.generate_text call).
+        """
+        return await asyncio.to_thread(self.retrieve, query, top_k=top_k, filter_fn=filter_fn,
+                                       candidate_mask=candidate_mask)
+    
+    def retrieve_batch(self, queries: List[str], top_k: int = 3,
+                       filter_fn: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                       candidate_mask: Optional[np.ndarray] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Vector-based retrieval for several queries at once
+
+        All queries are embedded in one forward pass and scored against the
+        corpus with a single matrix product. Returns one result list per query.
         """
         if len(self.chunks) == 0 or len(self.chunk_embeddings) == 0:
+            return [[] for _ in queries]
+        if not queries:
             return []
         
-        # Get query embedding
-        query_embedding = self.embedding_model.encode([query])[0]
+        candidates = None
+        if candidate_mask is not None:
+            candidates = np.flatnonzero(candidate_mask)
+        if filter_fn is not None:
+            if candidates is None:
+                candidates = range(len(self.chunks))
+            candidates = np.array([i for i in candidates if filter_fn(self.chunks[i])], dtype=np.intp)
+        if candidates is not None and len(candidates) == 0:
+            return [[] for _ in queries]
         
-        # Calculate similarity
-        similarities = cosine_similarity([query_embedding], self.chunk_embeddings)[0]
+        # Get query embeddings and cosine similarities against the pre-normalized embeddings,
+        # scoring only the candidate rows when the corpus is filtered
+        if candidates is None:
+            candidate_embeddings = self.normalized_embeddings
+        else:
+            candidate_embeddings = self.normalized_embeddings[candidates]
+        similarities = self.encode_queries(queries) @ candidate_embeddings.T
         
-        # Get top results
-        top_indices = similarities.argsort()[-top_k:][::-1]
+        # Return top results for each query, mapping candidate positions back to chunk indices
+        batch_results = []
+        for query_similarities in similarities:
+            results = []
+            for local_idx in top_k_indices(query_similarities, top_k):
+                idx = local_idx if candidates is None else candidates[local_idx]
+                results.append({
+                    'chunk_idx': idx,
+                    'text': self.chunks[idx]["text"],
+                    'metadata': self.chunks[idx]["metadata"],
+                    'score': float(query_similarities[local_idx])
+                })
+            batch_results.append(results)
         
-        # Return results
-        results = []
-        for idx in top_indices:
-            results.append({
-                'chunk_idx': idx,
-                'text': self.chunks[idx]["text"],
-                'metadata': self.chunks[idx]["metadata"],
-                'score': float(similarities[idx])
-            })
-        
-        return results
+        return batch_results
     
     def format_for_llm(self, query: str, results: List[Dict[str, Any]]) -> str:
         """
         Format retrieval results for LLM prompt
         """
-        formatted = f"Query: {query}\n\nRelevant information:\n\n"
-        
-        for i, result in enumerate(results):
-            formatted += f"[{i+1}] {result['text']}\n\n"
-        
-        return formatted
\ No newline at end of file
+        parts = [f"Query: {query}\n\nRelevant information:\n\n"]
+        parts.extend(f"[{i+1}] {result['text']}\n\n" for i, result in enumerate(results))
+        return "".join(parts)
\ No newline at end of file
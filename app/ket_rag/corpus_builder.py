@@ -2,11 +2,12 @@ import boto3
 import os
 import pickle
 import logging
-from typing import List
+from itertools import combinations
+from typing import List, Optional
 
 import networkx as nx
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from spacy.symbols import NOUN, PROPN
 
 from app.ket_rag.core import KETRAG
 from app.config import settings
@@ -17,6 +18,14 @@ from app.models import Document
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of documents whose chunks are embedded together in one encode call
+DOCUMENT_BATCH_SIZE = 32
+# Rows of a case's similarity matrix computed per gemm; bounds peak memory
+# at SIMILARITY_BLOCK_SIZE x (chunks in the case) floats
+SIMILARITY_BLOCK_SIZE = 1024
+# Parts of speech kept as keywords, as spaCy's integer symbol ids
+KEYWORD_POS = frozenset((NOUN, PROPN))
+
 
 class CorpusBuilder:
     """
@@ -41,12 +50,13 @@ class CorpusBuilder:
             documents = db.query(Document).filter(Document.visa_type == visa_type).all()
             logger.info(f"Found {len(documents)} documents for {visa_type}")
 
+            batch = []
             for doc in documents:
                 if not doc.extracted_text:
                     logger.warning(f"No extracted text for document {doc.id} - skipping")
                     continue
                 logger.info(f"Processing document: {doc.filename}")
-                self.ket_rag.process_document(
+                batch.append((
                     doc.extracted_text,
                     {
                         "id": doc.id,
@@ -59,7 +69,12 @@ class CorpusBuilder:
                         "s3_url": doc.s3_url,
                         "document_metadata": doc.document_metadata
                     }
-                )
+                ))
+                if len(batch) >= DOCUMENT_BATCH_SIZE:
+                    self.ket_rag.process_documents(batch)
+                    batch.clear()
+            if batch:
+                self.ket_rag.process_documents(batch)
 
         logger.info("Building knowledge graph...")
         self._build_knowledge_graph()
@@ -69,7 +84,8 @@ class CorpusBuilder:
 
         return self.ket_rag
 
-    def build_from_s3(self, bucket_name: str = settings.S3_BUCKET_NAME, visa_types: List[str] = ["EB1", "EB2"]) -> KETRAG:
+    def build_from_s3(self, bucket_name: Optional[str] = None, visa_types: List[str] = ["EB1", "EB2"]) -> KETRAG:
+        bucket_name = bucket_name or settings.S3_BUCKET_NAME
         logger.info(f"Building corpus from S3 bucket: {bucket_name}...")
         db = next(get_db())
 
@@ -81,6 +97,7 @@ class CorpusBuilder:
             ).all()
             logger.info(f"Found {len(documents)} documents with extracted text for {visa_type}")
 
+            batch = []
             for doc in documents:
                 try:
                     s3_key = doc.s3_url.split(f"{settings.S3_BUCKET_NAME}.s3.amazonaws.com/")[1]
@@ -89,7 +106,7 @@ class CorpusBuilder:
                     s3_key = None
 
                 logger.info(f"Processing document: {doc.filename}")
-                self.ket_rag.process_document(
+                batch.append((
                     doc.extracted_text,
                     {
                         "id": doc.id,
@@ -103,7 +120,12 @@ class CorpusBuilder:
                         "s3_url": doc.s3_url,
                         "document_metadata": doc.document_metadata
                     }
-                )
+                ))
+                if len(batch) >= DOCUMENT_BATCH_SIZE:
+                    self.ket_rag.process_documents(batch)
+                    batch.clear()
+            if batch:
+                self.ket_rag.process_documents(batch)
 
         logger.info("Building knowledge graph...")
         self._build_knowledge_graph()
@@ -117,68 +139,72 @@ class CorpusBuilder:
     
         logger.info(f"Building isolated knowledge graph from {len(self.ket_rag.    chunks)} chunks...")
         self.ket_rag.knowledge_graph.clear()
-        case_chunks = {}
+        normalized_embeddings = self.ket_rag.normalized_embeddings
+        chunks = self.ket_rag.chunks
+        case_codes = {}  # case_id -> integer code, in order of first appearance
+        chunk_case_codes = np.empty(len(chunks), dtype=np.intp)
         document_chunks = {}
     
-        for i, chunk in enumerate(self.ket_rag.chunks):
-            self.ket_rag.knowledge_graph.add_node(i, text=chunk["text"],     metadata=chunk["metadata"])
-            case_id = chunk["metadata"].get("case_id", "unknown")
-            case_chunks.setdefault(case_id, []).append((i, chunk))
-            doc_id = chunk["metadata"].get("id", f"unknown_{i}")
-            doc_key = f"{case_id}_{doc_id}"
+        self.ket_rag.knowledge_graph.add_nodes_from(
+            (i, {"text": chunk["text"], "metadata": chunk["metadata"]})
+            for i, chunk in enumerate(chunks)
+        )
+        for i, chunk in enumerate(chunks):
+            md = chunk["metadata"]
+            case_id = md.get("case_id", "unknown")
+            chunk_case_codes[i] = case_codes.setdefault(case_id, len(case_codes))
+            doc_key = (case_id, md.get("id", f"unknown_{i}"))
             document_chunks.setdefault(doc_key, []).append(i)
     
-        for case_id, case_data in case_chunks.items():
-            if len(case_data) < 2:
-                continue
+        # Group chunk indices by case with a stable argsort of the case codes;
+        # groups come out in case_codes order with indices ascending in each
+        order = np.argsort(chunk_case_codes, kind="stable")
+        case_groups = np.split(order, np.flatnonzero(np.diff(chunk_case_codes[order])) + 1)
     
-            case_doc_ids = set()
-            for _, chunk in case_data:
-                doc_id = chunk["metadata"].get("id", "unknown")
-                case_doc_ids.add(doc_id)
+        # Collect edges and insert them in bulk; later entries for the same pair
+        # update the earlier attributes exactly as successive add_edge calls did
+        case_edges = []
+        for case_id, case_indices in zip(case_codes, case_groups):
+            if len(case_indices) < 2:
+                continue
     
-            case_doc_ids = list(case_doc_ids)
-            for i in range(len(case_doc_ids)):
-                for j in range(i + 1, len(case_doc_ids)):
-                    doc1_id = case_doc_ids[i]
-                    doc2_id = case_doc_ids[j]
-                    doc1_key = f"{case_id}_{doc1_id}"
-                    doc2_key = f"{case_id}_{doc2_id}"
-                    doc1_chunks = document_chunks.get(doc1_key, [])
-                    doc2_chunks = document_chunks.get(doc2_key, [])
-                    if doc1_chunks and doc2_chunks:
-                        # Create bi-directional edges between documents in the same     case
-                        self.ket_rag.knowledge_graph.add_edge(
-                            doc1_chunks[0], doc2_chunks[0],
-                            weight=0.5,
-                            edge_type="same_case_explicit"
-                        )
-                        # Add the reverse edge to make it bi-directional
-                        self.ket_rag.knowledge_graph.add_edge(
-                            doc2_chunks[0], doc1_chunks[0],
-                            weight=0.5,
-                            edge_type="same_case_explicit"
-                        )
+            case_doc_ids = list({chunks[i]["metadata"].get("id", "unknown") for i in case_indices})
+            for doc1_id, doc2_id in combinations(case_doc_ids, 2):
+                doc1_chunks = document_chunks.get((case_id, doc1_id))
+                doc2_chunks = document_chunks.get((case_id, doc2_id))
+                if doc1_chunks and doc2_chunks:
+                    # Create bi-directional edges between documents in the same case
+                    case_edges.append((doc1_chunks[0], doc2_chunks[0],
+                                       {"weight": 0.5, "edge_type": "same_case_explicit"}))
+                    # Add the reverse edge to make it bi-directional
+                    case_edges.append((doc2_chunks[0], doc1_chunks[0],
+                                       {"weight": 0.5, "edge_type": "same_case_explicit"}))
     
-            case_indices = [idx for idx, _ in case_data]
-            case_embeddings = self.ket_rag.chunk_embeddings[case_indices]
-            similarity_matrix = cosine_similarity(case_embeddings)
+            # Cosine similarity as gemms over the pre-normalized embeddings, one block
+            # of rows at a time so large cases never hold a dense N x N matrix
+            case_embeddings = normalized_embeddings[case_indices]
             logger.info(f"Similarity matrix for case {case_id} with {len    (case_indices)} chunks:")
-            logger.info(similarity_matrix)
     
             threshold = 0.4
-            for i in range(len(case_indices)):
-                for j in range(len(case_indices)):
-                    if i != j and similarity_matrix[i, j] > threshold:
-                        self.ket_rag.knowledge_graph.add_edge(
-                            case_indices[i], case_indices[j],
-                            weight=float(similarity_matrix[i, j]),
-                            edge_type="same_case_similarity"
-                        )
+            for start in range(0, len(case_indices), SIMILARITY_BLOCK_SIZE):
+                block = case_embeddings[start:start + SIMILARITY_BLOCK_SIZE] @ case_embeddings.T
+                logger.debug(block)
+                above = block > threshold
+                # Exclude self-similarity, which sits on the block's offset diagonal
+                local = np.arange(len(block))
+                above[local, start + local] = False
+                rows, cols = np.nonzero(above)
+                case_edges.extend(
+                    (int(case_indices[start + i]), int(case_indices[j]),
+                     {"weight": float(block[i, j]), "edge_type": "same_case_similarity"})
+                    for i, j in zip(rows, cols)
+                )
     
+        self.ket_rag.knowledge_graph.add_edges_from(case_edges)
+    
+        # networkx>=3 runs PageRank as a scipy CSR power iteration
         pagerank = nx.pagerank(self.ket_rag.knowledge_graph)
-        for node, score in pagerank.items():
-            self.ket_rag.knowledge_graph.nodes[node]['pagerank'] = score
+        nx.set_node_attributes(self.ket_rag.knowledge_graph, pagerank, 'pagerank')
     
         # Add document type-based connections
         doc_type_chunks = {}
@@ -188,16 +214,11 @@ class CorpusBuilder:
                 doc_type_chunks.setdefault(doc_type, []).append(i)
         
         # Connect chunks of the same document type
+        group_edges = []
         for doc_type, chunk_indices in doc_type_chunks.items():
-            if len(chunk_indices) > 1:
-                for i in range(len(chunk_indices)):
-                    for j in range(i + 1, len(chunk_indices)):
-                        if chunk_indices[i] != chunk_indices[j]:  # Avoid self-loops
-                            self.ket_rag.knowledge_graph.add_edge(
-                                chunk_indices[i], chunk_indices[j],
-                                weight=0.3,
-                                edge_type="same_document_type"
-                            )
+            for u, v in combinations(chunk_indices, 2):
+                if u != v:  # Avoid self-loops
+                    group_edges.append((u, v, {"weight": 0.3, "edge_type": "same_document_type"}))
     
         # Add relevant sections-based connections
         section_chunks = {}
@@ -209,100 +230,103 @@ class CorpusBuilder:
         
         # Connect chunks that belong to the same letter section
         for section, chunk_indices in section_chunks.items():
-            if len(chunk_indices) > 1:
-                for i in range(len(chunk_indices)):
-                    for j in range(i + 1, len(chunk_indices)):
-                        if chunk_indices[i] != chunk_indices[j]:  # Avoid self-loops
-                            self.ket_rag.knowledge_graph.add_edge(
-                                chunk_indices[i], chunk_indices[j],
-                                weight=0.4,
-                                edge_type="same_relevant_section"
-                            )
+            for u, v in combinations(chunk_indices, 2):
+                if u != v:  # Avoid self-loops
+                    group_edges.append((u, v, {"weight": 0.4, "edge_type": "same_relevant_section"}))
+        
+        self.ket_rag.knowledge_graph.add_edges_from(group_edges)
     
         # Enhanced keyword chunk graph with section awareness
         self.ket_rag.keyword_chunk_graph.clear()
-        for i, chunk in enumerate(self.ket_rag.chunks):
+        # Tag all chunks through nlp.pipe so spaCy batches the work
+        texts = (chunk["text"] for chunk in self.ket_rag.chunks)
+        docs = self.ket_rag.nlp.pipe(texts, batch_size=64)
+        keyword_edges = []
+        for i, (chunk, doc) in enumerate(zip(self.ket_rag.chunks, docs)):
             case_id = chunk["metadata"].get("case_id", "unknown")
             relevant_sections = chunk["metadata"].get("relevant_sections") or []
-            doc = self.ket_rag.nlp(chunk["text"])
-            keywords = set()
-            for token in doc:
-                if token.pos_ in ["NOUN", "PROPN"] and len(token.text) > 2:
-                    keywords.add(token.lemma_.lower())
+            keywords = {token.lemma_.lower() for token in doc
+                        if token.pos in KEYWORD_POS and len(token) > 2}
+            
+            # Original case-scoped keywords
+            case_prefix = f"case_{case_id}_kw_"
+            case_chunk_node = f"chunk_    {i}"
+            keyword_edges.extend((case_prefix + keyword, case_chunk_node) for keyword in keywords)
             
-            for keyword in keywords:
-                # Original case-scoped keyword
-                scoped_keyword = f"case_{case_id}_kw_{keyword}"
-                self.ket_rag.keyword_chunk_graph.add_edge(scoped_keyword, f"chunk_    {i}")
-                
-                # Section-scoped keywords - handle None case
-                if relevant_sections:  # Check if not None/empty
-                    for section in relevant_sections:
-                        section_scoped_keyword = f"section_{section}_kw_{keyword}"
-                        self.ket_rag.keyword_chunk_graph.add_edge    (section_scoped_keyword, f"chunk_{i}")
+            # Section-scoped keywords - handle None case
+            if relevant_sections:  # Check if not None/empty
+                chunk_node = f"chunk_{i}"
+                for section in relevant_sections:
+                    section_prefix = f"section_{section}_kw_"
+                    keyword_edges.extend((section_prefix + keyword, chunk_node) for keyword in keywords)
+        
+        self.ket_rag.keyword_chunk_graph.add_edges_from(keyword_edges)
     
         logger.info(f"Built case-isolated knowledge graph with {self.ket_rag.    knowledge_graph.number_of_nodes()} nodes and {self.ket_rag.knowledge_graph.    number_of_edges()} edges")
     def build_customer_tree(self) -> nx.DiGraph:
-        case_ids = set(chunk["metadata"].get("case_id") for chunk in self.ket_rag.chunks if chunk["metadata"].get("case_id"))
-        logger.info(f"Building trees for {len(case_ids)} unique customers")
-        tree_graph = nx.DiGraph()
-        tree_graph.add_node("root", node_type="root", text="All Cases")
-
-        for case_id in case_ids:
-            tree_graph.add_node(f"case_{case_id}", node_type="case", case_id=case_id)
-            tree_graph.add_edge("root", f"case_{case_id}")
-
-        for chunk in self.ket_rag.chunks:
-            case_id = chunk["metadata"].get("case_id")
-            visa_type = chunk["metadata"].get("visa_type")
-            if case_id and visa_type:
-                visa_node_id = f"case_{case_id}_visa_{visa_type}"
-                if not tree_graph.has_node(visa_node_id):
-                    tree_graph.add_node(visa_node_id, node_type="visa_type", case_id=case_id, visa_type=visa_type)
-                    tree_graph.add_edge(f"case_{case_id}", visa_node_id)
-
-        for chunk in self.ket_rag.chunks:
-            case_id = chunk["metadata"].get("case_id")
-            visa_type = chunk["metadata"].get("visa_type")
-            category = chunk["metadata"].get("category")
-            if case_id and visa_type and category:
-                visa_node_id = f"case_{case_id}_visa_{visa_type}"
-                category_node_id = f"{visa_node_id}_cat_{category}"
-                if not tree_graph.has_node(category_node_id):
-                    tree_graph.add_node(category_node_id, node_type="category", case_id=case_id, visa_type=visa_type, category=category)
-                    tree_graph.add_edge(visa_node_id, category_node_id)
-
-        # Add document type level and connect documents
+        # Single pass over the chunks; each level's nodes are created the first time they are seen
+        nodes = [("root", {"node_type": "root", "text": "All Cases"})]
+        edges = []
+        seen = set()
+        case_count = 0
         for i, chunk in enumerate(self.ket_rag.chunks):
-            case_id = chunk["metadata"].get("case_id")
-            visa_type = chunk["metadata"].get("visa_type")
-            category = chunk["metadata"].get("category")
-            document_type = chunk["metadata"].get("document_type")
-            
-            if case_id and visa_type and category:
-                category_node_id = f"case_{case_id}_visa_{visa_type}_cat_{category}"
-                
-                if document_type:
-                    # Create document type level
-                    doc_type_node_id = f"{category_node_id}_type_{document_type}"
-                    if not tree_graph.has_node(doc_type_node_id):
-                        tree_graph.add_node(doc_type_node_id, 
-                                           node_type="document_type", 
-                                           case_id=case_id, 
-                                           visa_type=visa_type, 
-                                           category=category,
-                                           document_type=document_type)
-                        tree_graph.add_edge(category_node_id, doc_type_node_id)
-                    
-                    # Connect document to document type
-                    doc_node_id = f"{doc_type_node_id}_doc_{i}"
-                    tree_graph.add_node(doc_node_id, node_type="document", case_id=case_id, visa_type=visa_type, category=category, document_type=document_type, chunk_id=i, text=chunk["text"][:100])
-                    tree_graph.add_edge(doc_type_node_id, doc_node_id)
-                else:
-                    # Fallback for documents without document_type
-                    doc_node_id = f"{category_node_id}_doc_{i}"
-                    tree_graph.add_node(doc_node_id, node_type="document", case_id=case_id, visa_type=visa_type, category=category, chunk_id=i, text=chunk["text"][:100])
-                    tree_graph.add_edge(category_node_id, doc_node_id)
+            metadata = chunk["metadata"]
+            case_id = metadata.get("case_id")
+            if not case_id:
+                continue
+            case_node_id = f"case_{case_id}"
+            if case_node_id not in seen:
+                seen.add(case_node_id)
+                case_count += 1
+                nodes.append((case_node_id, {"node_type": "case", "case_id": case_id}))
+                edges.append(("root", case_node_id))
+
+            visa_type = metadata.get("visa_type")
+            if not visa_type:
+                continue
+            visa_node_id = f"{case_node_id}_visa_{visa_type}"
+            if visa_node_id not in seen:
+                seen.add(visa_node_id)
+                nodes.append((visa_node_id, {"node_type": "visa_type", "case_id": case_id, "visa_type": visa_type}))
+                edges.append((case_node_id, visa_node_id))
+
+            category = metadata.get("category")
+            if not category:
+                continue
+            category_node_id = f"{visa_node_id}_cat_{category}"
+            if category_node_id not in seen:
+                seen.add(category_node_id)
+                nodes.append((category_node_id, {"node_type": "category", "case_id": case_id, "visa_type": visa_type, "category": category}))
+                edges.append((visa_node_id, category_node_id))
+
+            # Add document type level and connect documents
+            document_type = metadata.get("document_type")
+            if document_type:
+                # Create document type level
+                doc_type_node_id = f"{category_node_id}_type_{document_type}"
+                if doc_type_node_id not in seen:
+                    seen.add(doc_type_node_id)
+                    nodes.append((doc_type_node_id, {"node_type": "document_type",
+                                                     "case_id": case_id,
+                                                     "visa_type": visa_type,
+                                                     "category": category,
+                                                     "document_type": document_type}))
+                    edges.append((category_node_id, doc_type_node_id))
+
+                # Connect document to document type
+                doc_node_id = f"{doc_type_node_id}_doc_{i}"
+                nodes.append((doc_node_id, {"node_type": "document", "case_id": case_id, "visa_type": visa_type, "category": category, "document_type": document_type, "chunk_id": i, "text": chunk["text"][:100]}))
+                edges.append((doc_type_node_id, doc_node_id))
+            else:
+                # Fallback for documents without document_type
+                doc_node_id = f"{category_node_id}_doc_{i}"
+                nodes.append((doc_node_id, {"node_type": "document", "case_id": case_id, "visa_type": visa_type, "category": category, "chunk_id": i, "text": chunk["text"][:100]}))
+                edges.append((category_node_id, doc_node_id))
+
+        logger.info(f"Building trees for {case_count} unique customers")
+        tree_graph = nx.DiGraph()
+        tree_graph.add_nodes_from(nodes)
+        tree_graph.add_edges_from(edges)
 
         self.ket_rag.customer_tree = tree_graph
         logger.info(f"Built customer tree with {tree_graph.number_of_nodes()} nodes and {tree_graph.number_of_edges()} edges")
@@ -311,7 +335,7 @@ class CorpusBuilder:
     def save_model(self, output_path: str = "ket_rag_model.pkl") -> None:
         logger.info(f"Saving model to {output_path}...")
         with open(output_path, 'wb') as f:
-            pickle.dump(self.ket_rag, f)
+            pickle.dump(self.ket_rag, f, protocol=pickle.HIGHEST_PROTOCOL)
         logger.info("Model saved successfully")
 
     def load_model(self, input_path: str = "ket_rag_model.pkl") -> KETRAG:
@@ -343,9 +367,10 @@ def test_corpus_builder():
         "Requirements for EB2 visa"
     ]
 
-    for query in test_queries:
+    # Embed and score all test queries in one pass
+    batch_results = ket_rag.retrieve_batch(test_queries, top_k=2)
+    for query, results in zip(test_queries, batch_results):
         print(f"\nQuery: {query}")
-        results = ket_rag.retrieve(query, top_k=2)
         if results:
             print(f"Found {len(results)} results:")
             for i, result in enumerate(results):
@@ -3,135 +3,27 @@ Letter generation module with atomic memory for KET-RAG
 """
 import logging
 import pickle
-from typing import Dict, Any, List, Optional
-import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Hashable, List, Optional
 
 from app.ket_rag.case_context import CaseContext
 from app.ket_rag.templates import TemplateRegistry
 from app.ket_rag.atomic_memory import AtomicMemory
+from app.ket_rag.letter_processor import LetterProcessor
 
 logger = logging.getLogger(__name__)
 
-class LetterProcessor:
-    """
-    Processes, stores, and indexes successful letter examples for retrieval
-    """
-    
-    def __init__(self, ketrag):
-        """Initialize with a reference to the KET-RAG system"""
-        self.ketrag = ketrag
-        self.letter_registry = {}  # Store metadata about processed letters
-    
-    def process_letter(self, letter_text: str, metadata: Dict[str, Any], sections: Optional[Dict[str, str]] = None) -> str:
-        """
-        Process a successful letter for indexing and retrieval
-        
-        Args:
-            letter_text: The full text of the letter
-            metadata: Dict containing visa_type, profession, outcome, etc.
-            sections: Optional dict mapping section IDs to section text
-            
-        Returns:
-            letter_id: Unique ID of the processed letter
-        """
-        letter_id = metadata.get("letter_id", str(uuid.uuid4()))
-        
-        # Store letter metadata
-        metadata["letter_id"] = letter_id
-        self.letter_registry[letter_id] = metadata
-        
-        # Process the whole letter if sections not provided
-        if not sections:
-            # Process the full letter text
-            self.ketrag.process_document(
-                letter_text,
-                {
-                    **metadata,
-                    "document_type": "successful_letter",
-                    "is_letter_example": True
-                }
-            )
-            logger.info(f"Processed full letter {letter_id} for {metadata.get('visa_type', 'unknown')}")
-            return letter_id
-            
-        # Process letter by sections
-        for section_id, section_text in sections.items():
-            # Process each section separately
-            self.ketrag.process_document(
-                section_text,
-                {
-                    **metadata,
-                    "document_type": "successful_letter",
-                    "is_letter_example": True,
-                    "section_id": section_id
-                }
-            )
-            logger.info(f"Processed section {section_id} of letter {letter_id}")
-        
-        return letter_id
-    
-    def retrieve_letter_examples(self, 
-                                visa_type: str, 
-                                profession: str, 
-                                section_id: str, 
-                                query: str,
-                                top_k: int = 3) -> List[Dict[str, Any]]:
-        """
-        Retrieve relevant examples from successful letters
-        
-        Args:
-            visa_type: Type of visa (EB1, EB2, etc.)
-            profession: Profession category
-            section_id: Specific section to retrieve
-            query: Query text to match against
-            top_k: Number of examples to retrieve
-            
-        Returns:
-            List of relevant chunks from successful letters
-        """
-        # Get all chunks
-        letter_examples = []
-        
-        for i, chunk in enumerate(self.ketrag.chunks):
-            metadata = chunk.get("metadata", {})
-            
-            # Check if this is a letter example matching criteria
-            if (metadata.get("is_letter_example", False) and
-                metadata.get("visa_type") == visa_type and
-                (not profession or metadata.get("profession") == profession) and
-                (not section_id or metadata.get("section_id") == section_id)):
-                
-                # Calculate similarity to query
-                # This is a simplification - use embed/retrieval in real version
-                letter_examples.append({
-                    "text": chunk["text"],
-                    "metadata": metadata,
-                    "chunk_id": i
-                })
-                
-                if len(letter_examples) >= top_k:
-                    break
-        
-        return letter_examples
-    
-    def get_letter_metadata(self, letter_id: str) -> Dict[str, Any]:
-        """Get metadata for a specific letter"""
-        return self.letter_registry.get(letter_id, {})
-    
-    def get_all_letters(self, visa_type: Optional[str] = None, profession: Optional[str] = None) -> List[Dict[str, Any]]:
-        """
-        Get all registered letters, optionally filtered by visa type or profession
-        
-        Returns list of letter metadata dictionaries
-        """
-        results = []
-        for letter_id, metadata in self.letter_registry.items():
-            if visa_type and metadata.get("visa_type") != visa_type:
-                continue
-            if profession and metadata.get("profession") != profession:
-                continue
-            results.append(metadata)
-        return results
+# Upper bound on concurrent LLM requests issued for one section or letter
+MAX_LLM_WORKERS = 8
+
+
+def _generate_parts(llm_client, prompts: Dict[Hashable, str]) -> Dict[Hashable, str]:
+    """Run the LLM on each template part's prompt concurrently, keeping part order"""
+    if len(prompts) <= 1:
+        return {part: llm_client.generate(prompt) for part, prompt in prompts.items()}
+    with ThreadPoolExecutor(max_workers=min(MAX_LLM_WORKERS, len(prompts))) as pool:
+        futures = {part: pool.submit(llm_client.generate, prompt) for part, prompt in prompts.items()}
+        return {part: future.result() for part, future in futures.items()}
 
 
 class LetterGenerator:
@@ -146,37 +38,62 @@ class LetterGenerator:
         self.template_registry = TemplateRegistry()
         self.atomic_memory = AtomicMemory()
         self.letter_processor = LetterProcessor(self.ket_rag)
+        self._case_ctx_cache: Dict[str, CaseContext] = {}
         logger.info("Letter generator initialized with atomic memory")
     
+    def _get_case_ctx(self, case_id: str) -> CaseContext:
+        """Get the cached CaseContext for a case, creating it on first use or after self.ket_rag is replaced"""
+        case_context = self._case_ctx_cache.get(case_id)
+        if case_context is None or case_context.ket_rag is not self.ket_rag:
+            case_context = self._case_ctx_cache[case_id] = CaseContext(self.ket_rag, case_id)
+        return case_context
+    
+    def clear_case_cache(self, case_id: Optional[str] = None) -> None:
+        """Drop cached case contexts (all of them, or just one case) after the corpus changes"""
+        if case_id is None:
+            self._case_ctx_cache.clear()
+        else:
+            self._case_ctx_cache.pop(case_id, None)
+    
     def format_chunks(self, chunks: List[Dict[str, Any]]) -> str:
         """Format chunks for inclusion in prompts"""
-        formatted = ""
-        for i, chunk in enumerate(chunks):
-            formatted += f"--- Document {i+1}: {chunk['metadata'].get('filename', 'Unknown')} ---\n"
-            formatted += chunk['text']
-            formatted += "\n\n"
-        return formatted
+        return "".join(
+            f"--- Document {i+1}: {chunk['metadata'].get('filename', 'Unknown')} ---\n{chunk['text']}\n\n"
+            for i, chunk in enumerate(chunks)
+        )
     
     def format_letter_examples(self, examples: List[Dict[str, Any]]) -> str:
         """Format letter examples for inclusion in prompts"""
         if not examples:
             return ""
             
-        formatted = "\n\nEXAMPLES FROM SUCCESSFUL LETTERS:\n"
+        parts = ["\n\nEXAMPLES FROM SUCCESSFUL LETTERS:\n"]
         for i, example in enumerate(examples):
             visa_type = example['metadata'].get('visa_type', 'Unknown')
             profession = example['metadata'].get('profession', 'Unknown')
-            formatted += f"--- Example {i+1} ({visa_type}, {profession}) ---\n"
-            formatted += example['text']
-            formatted += "\n\n"
-        return formatted
+            parts.append(f"--- Example {i+1} ({visa_type}, {profession}) ---\n{example['text']}\n\n")
+        return "".join(parts)
     
     def generate_section(self, case_id: str, section: str, profession: str, 
                         visa_type: str = "EB2", use_examples: bool = True, 
                         llm_client=None):
         """Generate a specific section for a case letter using atomic memory"""
-        # Create case context
-        case_context = CaseContext(self.ket_rag, case_id)
+        draft = self._draft_section(case_id, section, profession, visa_type, use_examples, llm_client)
+        if llm_client and "result" not in draft:
+            draft["part_contents"] = _generate_parts(llm_client, draft["part_prompts"])
+        return self._finish_section(draft)
+    
+    def _draft_section(self, case_id: str, section: str, profession: str,
+                       visa_type: str, use_examples: bool, llm_client) -> Dict[str, Any]:
+        """
+        Retrieve context and build the per-part LLM prompts for a section
+        
+        Returns a draft for _finish_section. With an llm_client the prompts are
+        left in "part_prompts" for the caller to run; a section with nothing to
+        draw on comes back with its final "result" already set.
+        """
+        # Get case context
+        case_context = self._get_case_ctx(case_id)
         
         # Get section requirements from atomic memory
         section_reqs = self.atomic_memory.get_section_requirements(section)
@@ -186,10 +103,9 @@ class LetterGenerator:
         all_chunks = []
         
         if primary_categories:
-            # Get chunks from each relevant category
-            for category in primary_categories:
-                query = f"Information for {section} from {category}"
-                category_chunks = case_context.retrieve_for_case(query, top_k=3)
+            # Get chunks from each relevant category, embedding all category queries at once
+            queries = [f"Information for {section} from {category}" for category in primary_categories]
+            for category_chunks in case_context.retrieve_batch_for_case(queries, top_k=3):
                 all_chunks.extend(category_chunks)
         else:
             # Fallback if no categories defined
@@ -210,12 +126,12 @@ class LetterGenerator:
         
         if not all_chunks and not letter_examples:
             logger.warning(f"No chunks or examples found for case {case_id}, section {section}")
-            return {
+            return {"result": {
                 "content": f"[No information available for {section}]",
                 "source_mapping": {},
                 "chunks_used": [],
                 "letter_examples_used": []
-            }
+            }}
         
         # Map chunks to specific template parts
         template_mapping = self.atomic_memory.map_chunks_to_parts(section, all_chunks)
@@ -225,11 +141,9 @@ class LetterGenerator:
         if letter_examples:
             letter_mapping = self.atomic_memory.map_letter_examples_to_parts(section, letter_examples)
         
-        # Get template
-        template = self.template_registry.get_template(profession, visa_type, section)
-        
         # Generate content for each template part
         part_contents = {}
+        part_prompts = {}
         source_citations = {}
         letter_citations = {}
         
@@ -255,9 +169,9 @@ class LetterGenerator:
             Focus specifically on information relevant to the '{part}' aspect.
             """
             
-            # Generate with LLM
+            # Generate with LLM (requests are issued concurrently below)
             if llm_client:
-                part_contents[part] = llm_client.generate(part_prompt)
+                part_prompts[part] = part_prompt
             else:
                 # Placeholder for testing
                 examples_used = f" with {len(part_examples)} letter examples" if part_examples else ""
@@ -283,9 +197,33 @@ class LetterGenerator:
                 for example in part_examples
             ]
         
+        return {
+            "section": section,
+            "profession": profession,
+            "visa_type": visa_type,
+            "part_prompts": part_prompts,
+            "part_contents": part_contents,
+            "template_mapping": template_mapping,
+            "letter_mapping": letter_mapping,
+            "source_citations": source_citations,
+            "letter_citations": letter_citations,
+            "all_chunks": all_chunks,
+            "letter_examples": letter_examples
+        }
+    
+    def _finish_section(self, draft: Dict[str, Any]) -> Dict[str, Any]:
+        """Render a drafted section from its part contents and record it in atomic memory"""
+        if "result" in draft:
+            return draft["result"]
+        section = draft["section"]
+        part_contents = draft["part_contents"]
+        template_mapping = draft["template_mapping"]
+        letter_mapping = draft["letter_mapping"]
+        
         # Try to format template with part contents
         try:
-            section_content = template.format(**part_contents)
+            section_content = self.template_registry.render(draft["profession"], draft["visa_type"], section,
+                                                            **part_contents)
         except KeyError as e:
             logger.error(f"Template formatting error: {e}")
             # Fallback to concatenation
@@ -304,17 +242,17 @@ class LetterGenerator:
         return {
             "content": section_content,
             "source_mapping": template_mapping,
-            "source_citations": source_citations,
+            "source_citations": draft["source_citations"],
             "letter_examples_mapping": letter_mapping,
-            "letter_citations": letter_citations,
-            "chunks_used": all_chunks,
-            "letter_examples_used": letter_examples
+            "letter_citations": draft["letter_citations"],
+            "chunks_used": draft["all_chunks"],
+            "letter_examples_used": draft["letter_examples"]
         }
     
     def generate_letter(self, case_id: str, profession: str, visa_type: str = "EB2", 
                       use_examples: bool = True, llm_client=None):
         """Generate a complete visa application letter with atomic memory tracing"""
-        case_context = CaseContext(self.ket_rag, case_id)
+        case_context = self._get_case_ctx(case_id)
         case_metadata = case_context.get_case_metadata()
         
         # Get sections for this visa type and profession
@@ -333,15 +271,26 @@ class LetterGenerator:
         letter_content = {}
         section_metadata = {}
         
-        for section in sections:
-            section_result = self.generate_section(
-                case_id=case_id, 
-                section=section, 
-                profession=profession,
-                visa_type=visa_type,
-                use_examples=use_examples,
-                llm_client=llm_client
-            )
+        # Draft every section first, then issue all of their LLM requests through
+        # one pool so requests from different sections overlap (up to
+        # MAX_LLM_WORKERS at once); sections are still finished in order
+        drafts = [
+            self._draft_section(case_id, section, profession, visa_type, use_examples, llm_client)
+            for section in sections
+        ]
+        if llm_client:
+            prompts = {
+                (i, part): prompt
+                for i, draft in enumerate(drafts) if "result" not in draft
+                for part, prompt in draft["part_prompts"].items()
+            }
+            contents = _generate_parts(llm_client, prompts)
+            for i, draft in enumerate(drafts):
+                if "result" not in draft:
+                    draft["part_contents"] = {part: contents[(i, part)] for part in draft["part_prompts"]}
+        
+        for section, draft in zip(sections, drafts):
+            section_result = self._finish_section(draft)
             letter_content[section] = section_result["content"]
             section_metadata[section] = {
                 "source_citations": section_result.get("source_citations", {}),
@@ -357,11 +306,11 @@ class LetterGenerator:
         """
         
         # Add each section in order
-        for section in sections:
-            if section in letter_content:
-                complete_letter += f"## {section.capitalize()}\n"
-                complete_letter += letter_content[section]
-                complete_letter += "\n\n"
+        complete_letter += "".join(
+            f"## {section.capitalize()}\n{letter_content[section]}\n\n"
+            for section in sections
+            if section in letter_content
+        )
         
         return {
             "full_letter": complete_letter,
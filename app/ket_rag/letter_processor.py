@@ -1,12 +1,32 @@
 """
 Letter processor for handling successful letter examples
 """
+import hashlib
 import logging
-from typing import Dict, List, Any, Optional
+from collections import ChainMap, defaultdict
+from typing import Dict, List, Any, Optional, Set
 import uuid
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
+# Metadata fields stamped on every indexed letter chunk
+LETTER_EXAMPLE_METADATA = {
+    "document_type": "successful_letter",
+    "is_letter_example": True
+}
+
+
+def _content_hash(*texts: str) -> str:
+    """Short blake2b digest identifying a letter or section by its content"""
+    digest = hashlib.blake2b(digest_size=16)
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
 class LetterProcessor:
     """
     Processes, stores, and indexes successful letter examples for retrieval
@@ -16,6 +36,104 @@ class LetterProcessor:
         """Initialize with a reference to the KET-RAG system"""
         self.ketrag = ketrag
         self.letter_registry = {}  # Store metadata about processed letters
+        # Inverted index of field -> value -> letter_ids, for filtering without scanning
+        self._index: Dict[str, Dict[Any, Set[str]]] = {
+            "visa_type": defaultdict(set),
+            "profession": defaultdict(set)
+        }
+        self._letter_order: Dict[str, int] = {}  # letter_id -> registration order
+        # (visa_type, profession) -> letter_id -> metadata, in registration order,
+        # serving the two-filter get_all_letters lookup without set intersections
+        self._letters_by_vp: Dict[tuple, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        self._letter_vp: Dict[str, tuple] = {}  # letter_id -> its _letters_by_vp key
+        # Per-chunk uint32 signatures ORing one bit per letter field value, aligned
+        # with ketrag.chunks (0 for chunks that are not letter examples)
+        self._chunk_sig = np.zeros(0, dtype=np.uint32)
+        self._sig_bits: Dict[tuple, int] = {}  # (field, value) -> signature bit
+        # Hashes of letters (-> letter_id) and letter sections that were fully
+        # indexed, so resubmitted content is not chunked and embedded again
+        self._letter_hashes: Dict[str, str] = {}
+        self._section_hashes: Set[str] = set()
+    
+    def _signature_bit(self, field: str, value: Any) -> int:
+        """Bit for a field value, assigned on first sight and wrapping after 32 values"""
+        bit = self._sig_bits.get((field, value))
+        if bit is None:
+            bit = self._sig_bits[(field, value)] = 1 << (len(self._sig_bits) % 32)
+        return bit
+    
+    def _update_signatures(self) -> np.ndarray:
+        """Compute signatures for chunks added to the KET-RAG system since the last call"""
+        chunks = self.ketrag.chunks
+        if len(chunks) < len(self._chunk_sig):
+            self._chunk_sig = np.zeros(0, dtype=np.uint32)
+        new_sigs = []
+        for chunk in chunks[len(self._chunk_sig):]:
+            metadata = chunk["metadata"]
+            if not metadata.get("is_letter_example", False):
+                new_sigs.append(0)
+                continue
+            new_sigs.append(self._signature_bit("visa_type", metadata.get("visa_type")) |
+                            self._signature_bit("profession", metadata.get("profession")) |
+                            self._signature_bit("section_id", metadata.get("section_id")))
+        if new_sigs:
+            self._chunk_sig = np.concatenate([self._chunk_sig, np.array(new_sigs, dtype=np.uint32)])
+        return self._chunk_sig
+    
+    def _query_signature(self, visa_type: str, profession: str, section_id: str) -> Optional[int]:
+        """Bits a matching chunk must have, or None if some value was never seen"""
+        fields = [("visa_type", visa_type)]
+        if profession:
+            fields.append(("profession", profession))
+        if section_id:
+            fields.append(("section_id", section_id))
+        query_sig = 0
+        for key in fields:
+            bit = self._sig_bits.get(key)
+            if bit is None:
+                return None
+            query_sig |= bit
+        return query_sig
+    
+    def _index_letter(self, letter_id: str, metadata: Dict[str, Any]) -> None:
+        """
+        Record a letter's visa type and profession in the inverted index
+        
+        Entries are only ever added: chunks from an earlier submission under the
+        same letter_id keep their old metadata, so lookups return a superset of
+        matching letters and callers confirm candidates against the metadata.
+        Section filtering in retrieve_letter_examples uses the chunk signatures,
+        which also cover letter chunks loaded with a saved corpus.
+        """
+        self._index["visa_type"][metadata.get("visa_type")].add(letter_id)
+        self._index["profession"][metadata.get("profession")].add(letter_id)
+        self._letter_order.setdefault(letter_id, len(self._letter_order))
+    
+    def _index_letter_pair(self, letter_id: str, metadata: Dict[str, Any]) -> None:
+        """File a letter under its (visa_type, profession) key, moving it if re-registered"""
+        key = (metadata.get("visa_type"), metadata.get("profession"))
+        old_key = self._letter_vp.get(letter_id)
+        self._letter_vp[letter_id] = key
+        bucket = self._letters_by_vp[key]
+        if old_key is None or old_key == key:
+            bucket[letter_id] = metadata
+            return
+        old_bucket = self._letters_by_vp[old_key]
+        del old_bucket[letter_id]
+        if not old_bucket:
+            del self._letters_by_vp[old_key]
+        # A moved letter keeps its original registration position
+        bucket[letter_id] = metadata
+        self._letters_by_vp[key] = dict(
+            sorted(bucket.items(), key=lambda item: self._letter_order[item[0]])
+        )
+    
+    def _matching_letter_ids(self, **filters) -> Set[str]:
+        """IDs of letters that may match every given field value, by intersecting index sets"""
+        matches = [self._index[field].get(value, set()) for field, value in filters.items()]
+        if not matches:
+            return set(self.letter_registry)
+        return set.intersection(*matches)
     
     def process_letter(self, letter_text: str, metadata: Dict[str, Any], sections: Optional[Dict[str, str]] = None) -> str:
         """
@@ -29,40 +147,59 @@ class LetterProcessor:
         Returns:
             letter_id: Unique ID of the processed letter
         """
+        # A resubmission must match the text, sections and metadata; an explicit
+        # letter_id only matches the letter already stored under that id
+        letter_hash = _content_hash(
+            letter_text,
+            *(part for item in sorted((sections or {}).items()) for part in item),
+            repr(sorted((key, value) for key, value in metadata.items() if key != "letter_id"))
+        )
+        letter_id = self._letter_hashes.get(letter_hash)
+        if letter_id is not None and metadata.get("letter_id", letter_id) == letter_id:
+            logger.info(f"Letter {letter_id} was already processed - skipping")
+            metadata["letter_id"] = letter_id
+            return letter_id
+        
         letter_id = metadata.get("letter_id", str(uuid.uuid4()))
         
         # Store letter metadata
         metadata["letter_id"] = letter_id
         self.letter_registry[letter_id] = metadata
+        self._index_letter(letter_id, metadata)
+        self._index_letter_pair(letter_id, metadata)
         
         # Process the whole letter if sections not provided
         if not sections:
             # Process the full letter text
-            self.ketrag.process_document(
-                letter_text,
-                {
-                    **metadata,
-                    "document_type": "successful_letter",
-                    "is_letter_example": True
-                }
-            )
+            self.ketrag.process_document(letter_text, {**metadata, **LETTER_EXAMPLE_METADATA})
+            self._letter_hashes[letter_hash] = letter_id
             logger.info(f"Processed full letter {letter_id} for {metadata.get('visa_type', 'unknown')}")
             return letter_id
             
-        # Process letter by sections
+        # Process letter by sections, embedding all of them in one batch;
+        # each section is still chunked as a separate document. The letter
+        # metadata is merged once and each section only layers its section_id
+        # over it (the chunker takes its own flat copy)
+        base_metadata = {**metadata, **LETTER_EXAMPLE_METADATA}
+        section_documents = []
+        section_hashes = []
         for section_id, section_text in sections.items():
-            # Process each section separately
-            self.ketrag.process_document(
-                section_text,
-                {
-                    **metadata,
-                    "document_type": "successful_letter",
-                    "is_letter_example": True,
-                    "section_id": section_id
-                }
-            )
-            logger.info(f"Processed section {section_id} of letter {letter_id}")
+            # Skip sections already indexed under the same visa type and profession
+            section_hash = _content_hash(str(metadata.get("visa_type")), str(metadata.get("profession")),
+                                         section_id, section_text)
+            if section_hash in self._section_hashes:
+                logger.info(f"Section {section_id} of letter {letter_id} was already processed - skipping")
+                continue
+            section_hashes.append(section_hash)
+            section_documents.append((section_text, ChainMap({"section_id": section_id}, base_metadata)))
+        
+        if section_documents:
+            self.ketrag.process_documents(section_documents)
+            logger.info(f"Processed {len(section_documents)} sections of letter {letter_id}")
         
+        # Only record the hashes once indexing succeeded, so a failed letter can be retried
+        self._section_hashes.update(section_hashes)
+        self._letter_hashes[letter_hash] = letter_id
         return letter_id
     
     def retrieve_letter_examples(self, 
@@ -94,11 +231,22 @@ class LetterProcessor:
                 (not section_id or metadata.get("section_id") == section_id)
             )
         
+        # Prefilter every chunk with one vectorized AND over the signatures, then
+        # confirm the survivors exactly (distinct values may share a bit)
+        sigs = self._update_signatures()
+        query_sig = self._query_signature(visa_type, profession, section_id)
+        if query_sig is None:
+            return []
+        candidate_mask = (sigs & query_sig) == query_sig
+        chunks = self.ketrag.chunks
+        for i in np.flatnonzero(candidate_mask):
+            candidate_mask[i] = letter_filter(chunks[i])
+        
         # Retrieve relevant examples
         results = self.ketrag.retrieve(
             query=query,
             top_k=top_k,
-            filter_fn=letter_filter
+            candidate_mask=candidate_mask
         )
         
         return results
@@ -113,11 +261,19 @@ class LetterProcessor:
         
         Returns list of letter metadata dictionaries
         """
-        results = []
-        for letter_id, metadata in self.letter_registry.items():
-            if visa_type and metadata.get("visa_type") != visa_type:
-                continue
-            if profession and metadata.get("profession") != profession:
-                continue
-            results.append(metadata)
-        return results
\ No newline at end of file
+        filters = {}
+        if visa_type:
+            filters["visa_type"] = visa_type
+        if profession:
+            filters["profession"] = profession
+        if not filters:
+            return list(self.letter_registry.values())
+        if visa_type and profession:
+            bucket = self._letters_by_vp.get((visa_type, profession))
+            return list(bucket.values()) if bucket else []
+        
+        letter_ids = sorted(self._matching_letter_ids(**filters), key=self._letter_order.__getitem__)
+        return [
+            metadata for metadata in map(self.letter_registry.__getitem__, letter_ids)
+            if all(metadata.get(field) == value for field, value in filters.items())
+        ]
\ No newline at end of file
@@ -1,11 +1,34 @@
 """
 Template registry for KET-RAG letter generation
 """
+import functools
 import logging
+import string
 from typing import Dict, Any, Tuple, Optional, List, Set
 
 logger = logging.getLogger(__name__)
 
+_FORMATTER = string.Formatter()
+
+def compile_template(template: str) -> Optional[List[Tuple[str, Optional[str]]]]:
+    """
+    Split a str.format template into (literal, field_name) pairs once, so that
+    rendering is a single join. Escaped {{ }} become literal braces, exactly as
+    str.format treats them. Returns None for templates using anything beyond
+    plain named fields (format specs, conversions, indexing), or malformed ones,
+    which are rendered with str.format instead.
+    """
+    try:
+        parsed = list(_FORMATTER.parse(template))
+    except ValueError:
+        return None
+    parts = []
+    for literal, field_name, format_spec, conversion in parsed:
+        if field_name is not None and (format_spec or conversion or not field_name.isidentifier()):
+            return None
+        parts.append((literal, field_name))
+    return parts
+
 class TemplateRegistry:
     """
     Registry for letter templates organized by profession, visa type, and section
@@ -14,6 +37,10 @@ class TemplateRegistry:
     def __init__(self):
         """Initialize the template registry"""
         self.templates = {}
+        self._compiled = {}  # template key -> compile_template() result
+        self._sections: Dict[Tuple[str, str], Set[str]] = {}  # (profession, visa_type) -> sections
+        # Memoized template key lookups, cleared whenever a template is added
+        self._resolve_key = functools.lru_cache(maxsize=512)(self._lookup_key)
         self._initialize_default_templates()
     
     def _initialize_default_templates(self):
@@ -113,47 +140,72 @@ class TemplateRegistry:
             }
         }
     
-    def get_template(self, profession: str, visa_type: str, section: str) -> str:
-        """
-        Get a template for a specific profession, visa type and section
-        
-        Strategy:
-        1. Try exact match (profession, visa_type, section)
-        2. Try profession wildcard (profession, "ANY", section)
-        3. Try visa wildcard ("ANY", visa_type, section)
-        4. Try generic (fallback to empty string)
-        """
+    def _lookup_key(self, profession: str, visa_type: str, section: str) -> Optional[Tuple[str, str, str]]:
+        """Key of the template that get_template would return, or None"""
         # Check for exact match
         exact_key = (profession, visa_type, section)
         if exact_key in self.templates:
-            return self.templates[exact_key]
+            return exact_key
         
         # Check for profession-specific template
         profession_key = (profession, "ANY", section)
         if profession_key in self.templates:
-            return self.templates[profession_key]
+            return profession_key
             
         # Check for visa-specific template
         visa_key = ("ANY", visa_type, section)
         if visa_key in self.templates:
-            return self.templates[visa_key]
+            return visa_key
+        
+        return None
+    
+    def get_template(self, profession: str, visa_type: str, section: str) -> str:
+        """
+        Get a template for a specific profession, visa type and section
+        
+        Strategy:
+        1. Try exact match (profession, visa_type, section)
+        2. Try profession wildcard (profession, "ANY", section)
+        3. Try visa wildcard ("ANY", visa_type, section)
+        4. Try generic (fallback to empty string)
+        """
+        key = self._resolve_key(profession, visa_type, section)
         
         # Return empty string if no match
-        return ""
+        return self.templates[key] if key is not None else ""
+    
+    def render(self, profession: str, visa_type: str, section: str, **values: Any) -> str:
+        """
+        Fill the template for a profession, visa type and section; equivalent to
+        get_template(...).format(**values), including the KeyError for missing values
+        """
+        key = self._resolve_key(profession, visa_type, section)
+        if key is None:
+            return ""
+        parts = self._compiled.get(key)
+        if parts is None:
+            return self.templates[key].format(**values)
+        return "".join([
+            literal if field_name is None else literal + format(values[field_name])
+            for literal, field_name in parts
+        ])
     
     def add_template(self, profession: str, visa_type: str, section: str, template: str):
         """Add or update a template"""
         key = (profession, visa_type, section)
         self.templates[key] = template
+        self._compiled[key] = compile_template(template)
+        self._sections.setdefault((profession, visa_type), set()).add(section)
+        self._resolve_key.cache_clear()
         logger.info(f"Added template for {profession}/{visa_type}/{section}")
     
     def get_sections(self, profession: str, visa_type: str) -> List[str]:
         """Get all available sections for a specific profession and visa type"""
         sections = set()
         
-        # Check for exact profession and visa
-        for (p, v, s) in self.templates.keys():
-            if (p == profession or p == "ANY") and (v == visa_type or v == "ANY"):
-                sections.add(s)
+        # Check for exact profession and visa, and their "ANY" wildcards
+        for p in {profession, "ANY"}:
+            for v in {visa_type, "ANY"}:
+                sections |= self._sections.get((p, v), set())
         
         return sorted(list(sections))
\ No newline at end of file
@@ -6,6 +6,7 @@ import pickle
 import logging
 from pathlib import Path
 import networkx as nx
+import numpy as np
 import matplotlib.pyplot as plt
 from pyvis.network import Network
 
@@ -13,6 +14,90 @@ from pyvis.network import Network
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Knowledge graph node colors by visa type
+VISA_TYPE_COLORS = {
+    "EB1": "#4169E1",  # RoyalBlue
+    "EB2": "#32CD32",  # LimeGreen
+}
+DEFAULT_NODE_COLOR = "#A9A9A9"  # DarkGray
+
+# vis.js options for each view, kept as parsed dicts so they are not
+# re-parsed from a JSON string on every visualization. pyvis only reads
+# them when rendering (json.dumps), so the module-level dicts are shared.
+_CUSTOMER_TREE_OPTIONS = {
+    "physics": {
+        "hierarchicalRepulsion": {
+            "nodeDistance": 120,
+            "centralGravity": 0.0,
+            "springLength": 100,
+            "springConstant": 0.01,
+            "damping": 0.09,
+        },
+        "solver": "hierarchicalRepulsion",
+        "stabilization": {
+            "iterations": 100,
+        },
+    },
+    "layout": {
+        "hierarchical": {
+            "enabled": True,
+            "direction": "UD",
+            "sortMethod": "directed",
+            "levelSeparation": 150,
+        },
+    },
+    "interaction": {
+        "navigationButtons": True,
+        "keyboard": True,
+    },
+}
+
+_KNOWLEDGE_GRAPH_OPTIONS = {
+    "physics": {
+        "forceAtlas2Based": {
+            "gravitationalConstant": -50,
+            "centralGravity": 0.01,
+            "springLength": 100,
+            "springConstant": 0.08,
+        },
+        "solver": "forceAtlas2Based",
+        "stabilization": {
+            "iterations": 100,
+        },
+    },
+    "interaction": {
+        "navigationButtons": True,
+        "keyboard": True,
+    },
+}
+
+def _add_nodes_bulk(net, nodes):
+    """Append prebuilt node dicts to a pyvis Network in one go.
+
+    Mirrors the bookkeeping of Network.add_node (nodes, node_ids, node_map)
+    without its per-call overhead; each dict must carry "id" and "shape".
+    """
+    net.nodes.extend(nodes)
+    net.node_ids.extend(node["id"] for node in nodes)
+    net.node_map.update((node["id"], node) for node in nodes)
+
+def _add_edges_bulk(net, edges):
+    """Append (u, v) edges to an undirected pyvis Network in one go.
+
+    Network.add_edge rescans every existing edge to drop duplicates, which is
+    quadratic over a whole graph. The knowledge graph is a DiGraph holding both
+    directions of each link, so a seen-set keeps the first of each unordered
+    pair, as add_edge would; both endpoints must already have been added.
+    """
+    seen = set()
+    bulk = []
+    for u, v in edges:
+        pair = frozenset((u, v))
+        if pair not in seen:
+            seen.add(pair)
+            bulk.append({"from": u, "to": v})
+    net.edges.extend(bulk)
+
 def load_model(model_path="ket_rag_corpus.pkl"):
     """Load the saved KETRAG model"""
     logger.info(f"Loading model from {model_path}")
@@ -40,9 +125,11 @@ def visualize_customer_tree(ket_rag, output_path="customer_tree.html"):
         "document": "#CD5C5C"   # IndianRed
     }
     
+    chunks = ket_rag.chunks
+    colors_get = colors.get
+    
     # Add nodes with colors based on type
-    for node_id in ket_rag.customer_tree.nodes():
-        node_data = ket_rag.customer_tree.nodes[node_id]
+    for node_id, node_data in ket_rag.customer_tree.nodes(data=True):
         node_type = node_data.get("node_type", "unknown")
         
         # Prepare node label and title (hover text)
@@ -67,8 +154,8 @@ def visualize_customer_tree(ket_rag, output_path="customer_tree.html"):
             title = f"Category: {category}\nVisa: {node_data.get('visa_type', 'unknown')}"
         elif node_type == "document":
             chunk_id = node_data.get('chunk_id', '')
-            if chunk_id != '' and chunk_id < len(ket_rag.chunks):
-                filename = ket_rag.chunks[chunk_id]["metadata"].get("filename", f"Doc {chunk_id}")
+            if chunk_id != '' and chunk_id < len(chunks):
+                filename = chunks[chunk_id]["metadata"].get("filename", f"Doc {chunk_id}")
                 label = filename
             else:
                 label = f"Doc {chunk_id}"
@@ -82,43 +169,14 @@ def visualize_customer_tree(ket_rag, output_path="customer_tree.html"):
             node_id, 
             label=label, 
             title=title,
-            color=colors.get(node_type, "#CCCCCC")
+            color=colors_get(node_type, "#CCCCCC")
         )
     
     # Add edges
-    for u, v in ket_rag.customer_tree.edges():
-        net.add_edge(u, v)
+    _add_edges_bulk(net, ket_rag.customer_tree.edges())
     
     # Configure physics
-    net.set_options("""
-    {
-      "physics": {
-        "hierarchicalRepulsion": {
-          "nodeDistance": 120,
-          "centralGravity": 0.0,
-          "springLength": 100,
-          "springConstant": 0.01,
-          "damping": 0.09
-        },
-        "solver": "hierarchicalRepulsion",
-        "stabilization": {
-          "iterations": 100
-        }
-      },
-      "layout": {
-        "hierarchical": {
-          "enabled": true,
-          "direction": "UD",
-          "sortMethod": "directed",
-          "levelSeparation": 150
-        }
-      },
-      "interaction": {
-        "navigationButtons": true,
-        "keyboard": true
-      }
-    }
-    """)
+    net.options = _CUSTOMER_TREE_OPTIONS
     
     # Save the visualization
     net.save_graph(output_path)
@@ -137,26 +195,44 @@ def visualize_knowledge_graph(ket_rag, output_path="knowledge_graph.html"):
     # Create a network
     net = Network(height="800px", width="100%", notebook=False)
     
-    # Add nodes
-    for i in ket_rag.knowledge_graph.nodes():
-        # Get metadata
-        node_data = ket_rag.knowledge_graph.nodes[i]
-        metadata = node_data.get("metadata", {})
-        
-        # Prepare label and title
-        case_id = metadata.get("case_id", "unknown")
-        visa_type = metadata.get("visa_type", "unknown")
-        category = metadata.get("category", "unknown")
-        filename = metadata.get("filename", f"Doc {i}")
-        label = f"{filename}: {visa_type}"
-        title = f"Case: {case_id}\nVisa: {visa_type}\nCategory: {category}\n\n{ket_rag.chunks[i]['text'][:200]}..."
-        
-        # Color by visa type
-        if visa_type == "EB1":
-            color = "#4169E1"  # RoyalBlue
-        elif visa_type == "EB2":
-            color = "#32CD32"  # LimeGreen
-        else:
-            color = "#A9A9A9"  # DarkGray
-        
-        # Size by PageRank
\ No newline at end of file
+    graph = ket_rag.knowledge_graph
+    chunks = ket_rag.chunks
+    
+    # Pull node ids, metadata and PageRank out once, then build every label,
+    # title, color and size in single passes instead of per-node branches
+    ids = list(graph.nodes())
+    metadata = [graph.nodes[i].get("metadata", {}) for i in ids]
+    visa_types = [m.get("visa_type", "unknown") for m in metadata]
+    labels = [
+        f"{m.get('filename', f'Doc {i}')}: {v}"
+        for i, m, v in zip(ids, metadata, visa_types)
+    ]
+    titles = [
+        f"Case: {m.get('case_id', 'unknown')}\nVisa: {v}\nCategory: {m.get('category', 'unknown')}\n\n{chunks[i]['text'][:200]}..."
+        for i, m, v in zip(ids, metadata, visa_types)
+    ]
+    colors = [VISA_TYPE_COLORS.get(v, DEFAULT_NODE_COLOR) for v in visa_types]
+    
+    # Size by PageRank, scaled to the most central chunk
+    pagerank = np.fromiter(
+        (graph.nodes[i].get("pagerank", 0.0) for i in ids), dtype=float, count=len(ids)
+    )
+    peak = pagerank.max() if pagerank.size else 0.0
+    sizes = 10 + 30 * (pagerank / peak if peak > 0 else pagerank)
+    
+    _add_nodes_bulk(net, [
+        {"id": i, "label": label, "title": title, "color": color, "size": float(size), "shape": "dot"}
+        for i, label, title, color, size in zip(ids, labels, titles, colors, sizes)
+    ])
+    
+    # Add edges
+    _add_edges_bulk(net, graph.edges())
+    
+    # Configure physics
+    net.options = _KNOWLEDGE_GRAPH_OPTIONS
+    
+    # Save the visualization
+    net.save_graph(output_path)
+    logger.info(f"Knowledge graph visualization saved to {output_path}")
+    
+    return output_path
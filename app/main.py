@@ -1,24 +1,36 @@
 from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, BackgroundTasks, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from starlette.formparsers import MultiPartParser
+from sqlalchemy import distinct, func, select
 from sqlalchemy.orm import Session
 import boto3
+from botocore.config import Config as BotoConfig
+from boto3.s3.transfer import TransferConfig
 from .database import get_db, Base, engine
 from .models import Document
 from .config import settings
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from http.client import HTTPConnection
+import logging
+import orjson
+import time
 import uuid
-from typing import List, Optional
-from pydantic import BaseModel
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+from typing_extensions import TypedDict
 from datetime import datetime
-import PyPDF2
+import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
 from io import BytesIO
-from docx import Document as DocxDocument  # Renamed to avoid conflict with your modelimport tempfile
+from docx import Document as DocxDocument  # Renamed to avoid conflict with your model
 import os
-import tempfile
-from pdf2image import convert_from_path
+from pdf2image import convert_from_bytes
 
 # Add this near the top of your main.py file
 DOCUMENT_TYPE_TO_SECTIONS = {
@@ -48,7 +60,91 @@ CATEGORY_TO_DOCUMENT_TYPES = {
     "08_Additional_Supporting_Documents": ["Memberships", "Certifications", "Salary_History"]
 }
 
-app = FastAPI()
+# Category lists served by /categories/{visa_type}, encoded once at import
+# so the handler returns cached bytes instead of rebuilding and
+# re-serializing the same payload on every request
+VISA_CATEGORIES = {
+    "EB1": (
+        "A. Evidence of receipt of lesser nationally or internationally recognized prizes or awards for excellence",
+        "B. Evidence of membership in associations in the field which demand outstanding achievement",
+        "C. Evidence of published material about the applicant",
+        "D. Evidence that the applicant has been asked to judge the work of others",
+        "E. Evidence of the applicant's original scientific, scholarly contributions",
+        "F. Evidence of the applicant's authorship of scholarly articles",
+        "G. Evidence that the applicant's work has been displayed",
+        "H. Evidence of the applicant's performance of a leading or critical role",
+        "I. Evidence that the applicant commands a high salary",
+        "J. Evidence of the applicant's commercial successes",
+        "Letters of Support",
+        "Professional Plan",
+    ),
+    "EB2": (
+        "01_General_Documents",
+        "02_Applicant_Background",
+        "03_NIW_Criterion_1_Significant_Merit_and_Importance",
+        "04_NIW_Criterion_2_Positioned_to_Advance_the_Field",
+        "05_NIW_Criterion_3_Benefit_to_USA_Without_Labor_Certification",
+        "06_Letters_of_Recommendation",
+        "07_Peer_Reviewed_Publications",
+        "08_Additional_Supporting_Documents",
+    ),
+}
+
+_CATEGORIES_JSON = {
+    visa_type: orjson.dumps({"categories": list(categories)})
+    for visa_type, categories in VISA_CATEGORIES.items()
+}
+
+# Document types served by /document_types/{visa_type}; EB2 offers every type
+# its categories map to, in order of first appearance
+VISA_DOCUMENT_TYPES = {
+    "EB1": (
+        "Resume",
+        "Academic_Records",
+        "Professional_Plan",
+        "Letters_of_Support",
+        "Publications",
+        "Expert_Opinion_Letter",
+        "Award_Certificates",
+        "Memberships",
+    ),
+    "EB2": tuple(dict.fromkeys(
+        doc_type for doc_types in CATEGORY_TO_DOCUMENT_TYPES.values() for doc_type in doc_types
+    )),
+}
+
+_DOCUMENT_TYPES_JSON = {
+    visa_type: orjson.dumps({"document_types": list(doc_types)})
+    for visa_type, doc_types in VISA_DOCUMENT_TYPES.items()
+}
+
+# Per-document-type {section: True} maps stored in each upload's metadata
+RELEVANT_SECTIONS_MAPPING = {
+    doc_type: {section: True for section in sections}
+    for doc_type, sections in DOCUMENT_TYPE_TO_SECTIONS.items()
+}
+
+logger = logging.getLogger(__name__)
+
+# Keep multipart uploads up to 32 MiB in memory instead of Starlette's 1 MiB
+# default, so typical letter PDFs are not spooled to disk before being read
+# back for S3 and text extraction; larger files still roll over to a temp file
+UPLOAD_SPOOL_MAX_SIZE = 32 * 1024 * 1024
+MultiPartParser.max_file_size = UPLOAD_SPOOL_MAX_SIZE
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create missing tables once per process at startup rather than at import;
+    # deployments that manage the schema with migrations can switch it off
+    if settings.CREATE_TABLES_ON_STARTUP:
+        Base.metadata.create_all(bind=engine)
+    # Start the PDF process pool's workers before any request runs PyMuPDF on
+    # the fitz thread, so no worker is forked in the middle of fitz work
+    await _get_pdf_pool()
+    yield
+    _shutdown_pdf_executors()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -65,7 +161,7 @@ app.add_middleware(
 async def read_root():
     return FileResponse("static/index.html")
 
-class DocumentSchema(BaseModel):
+class DocumentOut(TypedDict):
     id: str
     filename: str
     s3_url: str
@@ -73,49 +169,253 @@ class DocumentSchema(BaseModel):
     visa_type: str
     category: str
     uploaded_at: datetime
-    extracted_text: Optional[str] = None
-
-    class Config:
-        from_attributes = True
+    extracted_text: Optional[str]
+
+# Columns projected by /documents/, in DocumentOut order
+DOCUMENT_OUT_COLUMNS = (
+    Document.id,
+    Document.filename,
+    Document.s3_url,
+    Document.case_id,
+    Document.visa_type,
+    Document.category,
+    Document.uploaded_at,
+    Document.extracted_text,
+)
 
-Base.metadata.create_all(bind=engine)
+# http.client sends request bodies in blocksize pieces (8 KiB by default), which
+# makes large S3 transfers one send() syscall per 8 KiB. botocore's urllib3
+# connections inherit that default, so raise it process-wide before the clients
+# are created.
+SOCKET_BLOCKSIZE = 1024 * 1024
+HTTPConnection.__init__.__defaults__ = tuple(
+    SOCKET_BLOCKSIZE if default == 8192 else default
+    for default in HTTPConnection.__init__.__defaults__
+)
 
-s3_client = boto3.client(
-    "s3",
+# One shared session for all AWS clients. Explicit keys are optional; when they
+# are unset boto3 resolves credentials through its default chain. The pool
+# covers several concurrent requests each running a multipart transfer
+# (botocore's default is 10), and adaptive retries back off when S3 throttles
+boto_session = boto3.Session(
     region_name="us-east-2",
     aws_access_key_id=settings.AWS_ACCESS_KEY,
     aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
 )
+BOTO_CONFIG = BotoConfig(
+    max_pool_connections=50,
+    retries={"max_attempts": 10, "mode": "adaptive"},
+    tcp_keepalive=True
+)
 
-# Initialize Textract client
-textract_client = boto3.client(
-    'textract',
-    region_name="us-east-2",
-    aws_access_key_id=settings.AWS_ACCESS_KEY,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
+s3_client = boto_session.client(
+    "s3",
+    config=BOTO_CONFIG.merge(BotoConfig(s3={"addressing_style": "virtual"}))
+)
+
+# Uploads above 8 MiB go to S3 as parallel multipart transfers
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    io_chunksize=1024 * 1024,
+    max_io_queue=10000,
+    use_threads=True
 )
 
+# Initialize Textract client
+textract_client = boto_session.client('textract', config=BOTO_CONFIG)
+
+# PDF page text extraction is CPU-bound and holds the GIL, so larger PDFs are
+# split into page ranges across a process pool; smaller ones are read in this
+# process, where pickling the PDF to workers would cost more than it saves.
+# PyMuPDF does not support multithreaded use, so all in-process fitz work runs
+# on one dedicated thread (each process-pool worker is single-threaded too)
+PDF_EXTRACT_WORKERS = min(os.cpu_count() or 1, 4)
+PDF_PARALLEL_MIN_PAGES = 32
+_pdf_pool = None
+_fitz_executor = None
+
+def _get_fitz_executor() -> ThreadPoolExecutor:
+    global _fitz_executor
+    if _fitz_executor is None:
+        _fitz_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pymupdf")
+    return _fitz_executor
+
+def _start_pdf_pool() -> ProcessPoolExecutor:
+    """The PDF process pool, created if missing; runs on the fitz thread"""
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+        # The first submit forks the workers, here where no fitz work is running
+        _pdf_pool.submit(int)
+    return _pdf_pool
+
+async def _get_pdf_pool() -> ProcessPoolExecutor:
+    if _pdf_pool is not None:
+        return _pdf_pool
+    return await asyncio.get_running_loop().run_in_executor(_get_fitz_executor(), _start_pdf_pool)
+
+def _discard_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken PDF pool so the next large PDF starts a fresh one"""
+    global _pdf_pool
+    if _pdf_pool is pool:
+        _pdf_pool = None
+    pool.shutdown(wait=False)
+
+def _shutdown_pdf_executors() -> None:
+    """Stop the PDF pool's workers and the fitz thread, letting running extractions finish"""
+    global _pdf_pool, _fitz_executor
+    for executor in (_pdf_pool, _fitz_executor):
+        if executor is not None:
+            executor.shutdown()
+    _pdf_pool = _fitz_executor = None
+
+def _page_texts(pdf, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop) of an open document, each newline-terminated"""
+    page_texts = []
+    for page_num in range(start, stop):
+        try:
+            page_texts.append(pdf[page_num].get_text("text") + "\n")
+        except Exception as page_error:
+            logger.warning("Error extracting text from page %s: %s", page_num, page_error)
+            page_texts.append(f"[Error extracting page {page_num}]\n")
+    return page_texts
+
+def _extract_pdf_pages(pdf_bytes: bytes, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop), each newline-terminated; runs in a pool worker"""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf:
+        return _page_texts(pdf, start, stop)
+
+def _read_small_pdf(pdf_bytes: bytes) -> Tuple[int, Optional[List[str]]]:
+    """Page count, plus the page texts unless the PDF is large enough for the pool; runs on the fitz thread"""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf:
+        num_pages = pdf.page_count
+        if num_pages >= PDF_PARALLEL_MIN_PAGES:
+            return num_pages, None
+        return num_pages, _page_texts(pdf, 0, num_pages)
+
+async def extract_pdf_text(pdf_bytes: bytes) -> Tuple[int, str]:
+    """Page count and extracted text of a PDF, without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    num_pages, page_texts = await loop.run_in_executor(_get_fitz_executor(), _read_small_pdf, pdf_bytes)
+    if page_texts is None:
+        pool = await _get_pdf_pool()
+        step = -(-num_pages // PDF_EXTRACT_WORKERS)
+        try:
+            ranges = await asyncio.gather(*[
+                loop.run_in_executor(
+                    pool, _extract_pdf_pages, pdf_bytes, start, min(start + step, num_pages)
+                )
+                for start in range(0, num_pages, step)
+            ])
+        except BrokenProcessPool:
+            # A worker died (e.g. MuPDF crashed on a malformed PDF), which breaks
+            # the whole pool; replace it rather than failing every later PDF
+            _discard_pdf_pool(pool)
+            raise
+        page_texts = [text for page_range in ranges for text in page_range]
+    return num_pages, "".join(page_texts)
+
+def extract_docx_text(fileobj) -> str:
+    """Paragraph text of a .docx file, one paragraph per line"""
+    doc = DocxDocument(fileobj)
+    return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+
+# Each pytesseract call runs the tesseract binary in a subprocess, so a thread
+# pool is enough to OCR pages in parallel without shipping images to processes
+OCR_WORKERS = min(os.cpu_count() or 1, 6)
+
+def ocr_pdf(pdf_bytes: bytes) -> str:
+    """OCR every page of a PDF, rasterizing and recognizing pages in parallel"""
+    images = convert_from_bytes(pdf_bytes, dpi=200, thread_count=OCR_WORKERS)
+    with ThreadPoolExecutor(max_workers=OCR_WORKERS) as executor:
+        page_texts = list(executor.map(pytesseract.image_to_string, images))
+    return "".join(page_text + "\n\n" for page_text in page_texts)
+
+# File types Textract accepts, the inline-bytes limit of its synchronous API,
+# and how long to poll an asynchronous job for larger files
+TEXTRACT_EXTENSIONS = frozenset(("pdf", "png", "jpg", "jpeg", "tiff", "tif"))
+TEXTRACT_SYNC_MAX_BYTES = 10 * 1024 * 1024
+TEXTRACT_POLL_INTERVAL = 2
+TEXTRACT_MAX_WAIT = 120
+
+def textract_lines(responses) -> str:
+    """Newline-terminated LINE block text across Textract result pages"""
+    return "".join(
+        block["Text"] + "\n"
+        for response in responses
+        for block in response["Blocks"]
+        if block["BlockType"] == "LINE"
+    )
+
+def textract_s3_object(s3_key: str) -> str:
+    """Detect text in a documents-bucket object with an asynchronous Textract job (blocking)"""
+    job_id = textract_client.start_document_text_detection(
+        DocumentLocation={"S3Object": {"Bucket": settings.S3_BUCKET_NAME, "Name": s3_key}}
+    )["JobId"]
+    deadline = time.monotonic() + TEXTRACT_MAX_WAIT
+    response = textract_client.get_document_text_detection(JobId=job_id)
+    while response["JobStatus"] == "IN_PROGRESS":
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Textract job {job_id} did not finish in {TEXTRACT_MAX_WAIT}s")
+        time.sleep(TEXTRACT_POLL_INTERVAL)
+        response = textract_client.get_document_text_detection(JobId=job_id)
+    if response["JobStatus"] != "SUCCEEDED":
+        raise RuntimeError(f"Textract job {job_id} ended with status {response['JobStatus']}")
+    
+    responses = [response]
+    while "NextToken" in response:
+        response = textract_client.get_document_text_detection(JobId=job_id, NextToken=response["NextToken"])
+        responses.append(response)
+    return textract_lines(responses)
+
+# Chunk size for streaming S3 object bodies back to clients
+S3_STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Maximum number of keys S3 accepts in one DeleteObjects request
+S3_DELETE_BATCH_SIZE = 1000
+
+def document_s3_key(s3_key: Optional[str], s3_url: str) -> str:
+    """Stored object key of a document, parsed from its URL for rows uploaded before s3_key existed"""
+    return s3_key or s3_url.split(f"{settings.S3_BUCKET_NAME}.s3.amazonaws.com/")[1]
+
+def read_s3_object(s3_key: str) -> bytes:
+    """Fetch an object's full body from the documents bucket (blocking)"""
+    response = s3_client.get_object(Bucket=settings.S3_BUCKET_NAME, Key=s3_key)
+    return response['Body'].read()
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def hash_fileobj(fileobj) -> str:
+    """SHA-256 hex digest of a file object's contents, read in 1 MiB blocks (blocking)"""
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
 def upload_to_s3(file: UploadFile, case_id: str, visa_type: str, category: str):
     try:
-        print(f"Starting S3 upload process...")
-        print(f"Case ID: {case_id}")
-        print(f"Visa Type: {visa_type}")
-        print(f"Category: {category}")
+        logger.debug("Starting S3 upload process...")
+        logger.debug("Case ID: %s", case_id)
+        logger.debug("Visa Type: %s", visa_type)
+        logger.debug("Category: %s", category)
         
         file_id = str(uuid.uuid4())
         s3_key = f"raw/{case_id}/{visa_type}/{category}/{file_id}_{file.filename}"
         
-        print(f"S3 Key: {s3_key}")
+        logger.debug("S3 Key: %s", s3_key)
         
         file.file.seek(0)
-        s3_client.upload_fileobj(file.file, settings.S3_BUCKET_NAME, s3_key)
+        s3_client.upload_fileobj(file.file, settings.S3_BUCKET_NAME, s3_key, Config=TRANSFER_CONFIG)
         
         s3_url = f"https://{settings.S3_BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
-        print(f"File uploaded successfully to: {s3_url}")
+        logger.debug("File uploaded successfully to: %s", s3_url)
         
         return s3_url
     except Exception as e:
-        print(f"S3 Upload Error: {str(e)}")
+        logger.error("S3 Upload Error: %s", e)
         raise HTTPException(status_code=500, detail=f"S3 Upload Error: {str(e)}")
 
 
@@ -130,10 +430,35 @@ async def upload_file(
     db: Session = Depends(get_db)
 ):
     try:
-        print(f"Processing upload for case: {case_id}")
-
-        # Read file content once
-        file_bytes = await file.read()
+        logger.debug("Processing upload for case: %s", case_id)
+
+        # The same bytes uploaded again to the same case slot reuse the stored
+        # document instead of repeating the S3 transfer and text extraction
+        content_sha256 = await asyncio.to_thread(hash_fileobj, file.file)
+        existing = db.query(
+                Document.s3_url,
+                Document.document_type,
+                Document.relevant_sections,
+                Document.document_metadata
+            )\
+            .filter(
+                Document.case_id == case_id,
+                Document.content_sha256 == content_sha256,
+                Document.visa_type == visa_type,
+                Document.category == category
+            )\
+            .first()
+        if existing:
+            logger.debug("Duplicate upload for case %s: %s", case_id, content_sha256)
+            return {
+                "status": "success",
+                "message": f"File already uploaded for case {case_id}",
+                "file_url": existing.s3_url,
+                "document_type": existing.document_type,
+                "relevant_sections": existing.relevant_sections or [],
+                "extracted_text_status": (existing.document_metadata or {}).get("text_extraction_status"),
+                "duplicate": True
+            }
 
         # Initialize variables
         num_pages = None
@@ -156,68 +481,59 @@ async def upload_file(
         s3_key = f"raw/{case_id}/{visa_type}/{category}/{file_id}_{file.filename}"
 
         try:
-            s3_client.put_object(
-                Bucket=settings.S3_BUCKET_NAME,
-                Key=s3_key,
-                Body=file_bytes
+            # Stream the spooled upload straight to S3 (multipart above the
+            # threshold) in a worker thread so the event loop stays free and
+            # the file is never copied into a bytes object
+            await file.seek(0)
+            await asyncio.to_thread(
+                s3_client.upload_fileobj,
+                file.file,
+                settings.S3_BUCKET_NAME,
+                s3_key,
+                Config=TRANSFER_CONFIG
             )
             s3_url = f"https://{settings.S3_BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
         except Exception as e:
-            print(f"S3 Upload Error: {str(e)}")
+            logger.error("S3 Upload Error: %s", e)
             raise HTTPException(status_code=500, detail=f"S3 Upload Error: {str(e)}")
 
         # Extract text using the new method
         try:
-            # Create a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as temp_file:
-                temp_file.write(file_bytes)
-                temp_file_path = temp_file.name
-
-            # Extract text based on file type
+            # Extract text based on file type, reading the spooled upload
+            # directly rather than round-tripping a temp file
+            await file.seek(0)
             if file_extension == "pdf":
-                with open(temp_file_path, 'rb') as file_handle:
-                    pdf_reader = PyPDF2.PdfReader(file_handle)
-                    num_pages = len(pdf_reader.pages)
-                    extracted_text = ''
-                    for page_num in range(num_pages):
-                        page = pdf_reader.pages[page_num]
-                        try:
-                            extracted_text += page.extract_text() + "\n"
-                        except Exception as page_error:
-                            print(f"Error extracting text from page {page_num}: {str(page_error)}")
-                            extracted_text += f"[Error extracting page {page_num}]\n"
+                num_pages, extracted_text = await extract_pdf_text(await file.read())
             elif file_extension == "docx":
-                doc = DocxDocument(temp_file_path)
-                extracted_text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+                extracted_text = await asyncio.to_thread(extract_docx_text, file.file)
             else:
                 extracted_text = "Unsupported file type"
 
             text_extraction_status = "completed"
 
-            # Clean up temporary file
-            os.unlink(temp_file_path)
-
         except Exception as extract_error:
-            print(f"Text Extraction Error: {str(extract_error)}")
+            logger.error("Text Extraction Error: %s", extract_error)
             extracted_text = ""
             text_extraction_status = "failed"
 
         # Generate metadata
         document_metadata = {
-            "file_size": len(file_bytes),
+            "file_size": file.size,
             "content_type": file.content_type if hasattr(file, 'content_type') else f"application/{file_extension}",
             "upload_timestamp": datetime.utcnow().isoformat(),
             "original_filename": file.filename,
             "text_extraction_status": text_extraction_status,
             "file_extension": file_extension,
             "pages": num_pages,
-            "relevant_sections_mapping": {section: True for section in relevant_sections}  # Include mapping in metadata
+            "relevant_sections_mapping": RELEVANT_SECTIONS_MAPPING.get(doc_type, {})  # Include mapping in metadata
         }
 
         # Create document with all fields
         document = Document(
             filename=file.filename,
             s3_url=s3_url,
+            s3_key=s3_key,
+            content_sha256=content_sha256,
             case_id=case_id,
             visa_type=visa_type,
             category=category,
@@ -239,119 +555,70 @@ async def upload_file(
             "extracted_text_status": text_extraction_status
         }
     except Exception as e:
-        print(f"Upload Error: {str(e)}")
+        logger.error("Upload Error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/documents/")
+# DocumentOut is only declared for the OpenAPI docs; rows come straight from the
+# database, so they go to orjson as plain dicts without response-model validation
+# or a jsonable_encoder pass
+@app.get("/documents/", responses={200: {"model": List[DocumentOut]}})
 async def get_documents(
     db: Session = Depends(get_db),
     case_id: Optional[str] = None,
     visa_type: Optional[str] = None
 ):
-    query = db.query(Document)
+    query = select(*DOCUMENT_OUT_COLUMNS)
     if case_id:
-        query = query.filter(Document.case_id == case_id)
+        query = query.where(Document.case_id == case_id)
     if visa_type:
-        query = query.filter(Document.visa_type == visa_type)
-    return query.order_by(Document.uploaded_at.desc()).all()
+        query = query.where(Document.visa_type == visa_type)
+    rows = db.execute(query.order_by(Document.uploaded_at.desc())).mappings().all()
+    return ORJSONResponse([dict(row) for row in rows])
 
 @app.get("/document_types/{visa_type}")
 async def get_document_types(visa_type: str):
     """Get available document types for a specific visa type"""
-    if visa_type == "EB1":
-        return {
-            "document_types": [
-                "Resume",
-                "Academic_Records",
-                "Professional_Plan",
-                "Letters_of_Support",
-                "Publications",
-                "Expert_Opinion_Letter",
-                "Award_Certificates",
-                "Memberships"
-            ]
-        }
-    elif visa_type == "EB2":
-        return {
-            "document_types": list(set(sum([types for types in CATEGORY_TO_DOCUMENT_TYPES.values()], [])))
-        }
-    else:
+    payload = _DOCUMENT_TYPES_JSON.get(visa_type)
+    if payload is None:
         raise HTTPException(status_code=400, detail="Invalid visa type")
+    return Response(content=payload, media_type="application/json")
         
 @app.get("/categories/{visa_type}")
 async def get_categories(visa_type: str):
-    if visa_type == "EB1":
-        return {
-            "categories": [
-                "A. Evidence of receipt of lesser nationally or internationally recognized prizes or awards for excellence",
-                "B. Evidence of membership in associations in the field which demand outstanding achievement",
-                "C. Evidence of published material about the applicant",
-                "D. Evidence that the applicant has been asked to judge the work of others",
-                "E. Evidence of the applicant's original scientific, scholarly contributions",
-                "F. Evidence of the applicant's authorship of scholarly articles",
-                "G. Evidence that the applicant's work has been displayed",
-                "H. Evidence of the applicant's performance of a leading or critical role",
-                "I. Evidence that the applicant commands a high salary",
-                "J. Evidence of the applicant's commercial successes",
-                "Letters of Support",
-                "Professional Plan"
-            ]
-        }
-    elif visa_type == "EB2":
-        return {
-            "categories": [
-                "01_General_Documents",
-                "02_Applicant_Background",
-                "03_NIW_Criterion_1_Significant_Merit_and_Importance",
-                "04_NIW_Criterion_2_Positioned_to_Advance_the_Field",
-                "05_NIW_Criterion_3_Benefit_to_USA_Without_Labor_Certification",
-                "06_Letters_of_Recommendation",
-                "07_Peer_Reviewed_Publications",
-                "08_Additional_Supporting_Documents"
-            ]
-        }
-    else:
+    payload = _CATEGORIES_JSON.get(visa_type)
+    if payload is None:
         raise HTTPException(status_code=400, detail="Invalid visa type")
+    return Response(content=payload, media_type="application/json")
 
 
-@app.get("/document_types/{visa_type}")
-async def get_document_types(visa_type: str):
-    if visa_type == "EB1":
-        return {
-            "document_types": [
-                "Resume",
-                "Academic_Records",
-                "Professional_Plan",
-                "Letters_of_Support",
-                "Publications",
-                "Expert_Opinion_Letter",
-                "Award_Certificates",
-                "Memberships"
-            ]
-        }
-    elif visa_type == "EB2":
-        return {
-            "document_types": [
-                "Resume",
-                "Academic_Records",
-                "Professional_Plan",
-                "Letters_of_Support",
-                "Expert_Opinion_Letter",
-                "Certifications",
-                "Salary_History",
-                "Industry_Reports",
-                "Publications",
-                "Memberships"
-            ]
-        }
-    else:
-        raise HTTPException(status_code=400, detail="Invalid visa type")
         
     
+@app.get("/cases/")
+async def get_cases(db: Session = Depends(get_db)):
+    """List cases with their visa types, grouped in the database, most recent upload first"""
+    rows = db.execute(
+        select(
+            Document.case_id,
+            func.array_agg(distinct(Document.visa_type)).label("visa_types")
+        )
+        .group_by(Document.case_id)
+        .order_by(func.max(Document.uploaded_at).desc())
+    ).mappings().all()
+    return ORJSONResponse([dict(row) for row in rows])
+
 @app.get("/cases/{case_id}")
 async def get_case_files(case_id: str, db: Session = Depends(get_db)):
     try:
-        documents = db.query(Document)\
+        # Project only the listed columns so extracted_text and the JSON
+        # metadata are never loaded; served by ix_documents_case_id_uploaded_at
+        documents = db.query(
+                Document.id,
+                Document.filename,
+                Document.s3_url,
+                Document.category,
+                Document.uploaded_at,
+                Document.visa_type
+            )\
             .filter(Document.case_id == case_id)\
             .order_by(Document.uploaded_at.desc())\
             .all()
@@ -370,7 +637,7 @@ async def get_case_files(case_id: str, db: Session = Depends(get_db)):
             "download_url": f"/download/{doc.id}"
         } for doc in documents]
 
-        return {"files": files}
+        return ORJSONResponse({"files": files})
     except Exception as e:
         print(f"Error fetching case files: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -382,9 +649,10 @@ async def delete_file(file_id: str, db: Session = Depends(get_db)):
         if not document:
             raise HTTPException(status_code=404, detail="File not found")
 
-        s3_key = document.s3_url.split(f"{settings.S3_BUCKET_NAME}.s3.amazonaws.com/")[1]
+        s3_key = document_s3_key(document.s3_key, document.s3_url)
         try:
-            s3_client.delete_object(
+            await asyncio.to_thread(
+                s3_client.delete_object,
                 Bucket=settings.S3_BUCKET_NAME,
                 Key=s3_key
             )
@@ -403,20 +671,26 @@ async def delete_file(file_id: str, db: Session = Depends(get_db)):
 @app.delete("/documents/{case_id}")
 async def delete_case(case_id: str, db: Session = Depends(get_db)):
     try:
-        documents = db.query(Document).filter(Document.case_id == case_id).all()
+        s3_keys = [
+            document_s3_key(s3_key, s3_url)
+            for s3_key, s3_url in db.query(Document.s3_key, Document.s3_url).filter(Document.case_id == case_id)
+        ]
         
-        for document in documents:
-            s3_key = document.s3_url.split(f"{settings.S3_BUCKET_NAME}.s3.amazonaws.com/")[1]
+        # DeleteObjects removes up to 1000 keys per request
+        for start in range(0, len(s3_keys), S3_DELETE_BATCH_SIZE):
+            batch = s3_keys[start:start + S3_DELETE_BATCH_SIZE]
             try:
-                s3_client.delete_object(
+                response = await asyncio.to_thread(
+                    s3_client.delete_objects,
                     Bucket=settings.S3_BUCKET_NAME,
-                    Key=s3_key
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
                 )
+                for error in response.get("Errors", []):
+                    print(f"S3 Delete Error for key {error.get('Key')}: {error.get('Message')}")
             except Exception as e:
-                print(f"S3 Delete Error for file {document.filename}: {str(e)}")
-                
-            db.delete(document)
+                print(f"S3 Delete Error for {len(batch)} files: {str(e)}")
         
+        db.query(Document).filter(Document.case_id == case_id).delete(synchronize_session=False)
         db.commit()
         return {"message": f"Case {case_id} and all associated files deleted successfully"}
     except Exception as e:
@@ -427,7 +701,9 @@ async def delete_case(case_id: str, db: Session = Depends(get_db)):
 async def preview_file(file_id: str, db: Session = Depends(get_db)):
     try:
         # First check if we already have extracted text in the database
-        document = db.query(Document).filter(Document.id == file_id).first()
+        document = db.query(Document.extracted_text, Document.filename, Document.s3_key, Document.s3_url)\
+            .filter(Document.id == file_id)\
+            .first()
         if not document:
             raise HTTPException(status_code=404, detail="File not found")
 
@@ -436,76 +712,53 @@ async def preview_file(file_id: str, db: Session = Depends(get_db)):
             return {"text": document.extracted_text}
 
         # Get file from S3
-        s3_key = document.s3_url.split(f"{settings.S3_BUCKET_NAME}.s3.amazonaws.com/")[1]
-        response = s3_client.get_object(Bucket=settings.S3_BUCKET_NAME, Key=s3_key)
-        file_bytes = response['Body'].read()
+        s3_key = document_s3_key(document.s3_key, document.s3_url)
+        file_bytes = await asyncio.to_thread(read_s3_object, s3_key)
 
         extracted_text = ""
         
-        # 1. First try Textract for non-scanned PDFs and Word docs
-        try:
-            print("Attempting Textract extraction...")
-            textract_response = textract_client.detect_document_text(
-                Document={'Bytes': file_bytes}
-            )
-            
-            for item in textract_response["Blocks"]:
-                if item["BlockType"] == "LINE":
-                    extracted_text += item["Text"] + "\n"
-                    
-        except Exception as textract_error:
-            print(f"Textract failed: {str(textract_error)}")
-            extracted_text = ""
+        # 1. First try Textract for PDFs and images (it rejects other formats,
+        # so skip the round trip for them); the synchronous API only takes
+        # inline documents up to 10 MB, larger ones run as an S3-based job
+        file_extension = document.filename.rsplit(".", 1)[-1].lower()
+        if file_extension in TEXTRACT_EXTENSIONS:
+            try:
+                print("Attempting Textract extraction...")
+                if len(file_bytes) <= TEXTRACT_SYNC_MAX_BYTES:
+                    textract_response = await asyncio.to_thread(
+                        textract_client.detect_document_text,
+                        Document={'Bytes': file_bytes}
+                    )
+                    extracted_text = textract_lines([textract_response])
+                else:
+                    extracted_text = await asyncio.to_thread(textract_s3_object, s3_key)
+
+            except Exception as textract_error:
+                print(f"Textract failed: {str(textract_error)}")
+                extracted_text = ""
 
         # 2. If Textract didn't work, try OCR for scanned documents
         if not extracted_text.strip():
             print("Attempting OCR extraction...")
             try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_input_file:
-                    temp_input_path = temp_input_file.name
-                    temp_input_file.write(file_bytes)
-
-                # Convert PDF to images
-                images = convert_from_path(temp_input_path)
-                
-                # Process each page
-                for image in images:
-                    # Use pytesseract to extract text from image
-                    page_text = pytesseract.image_to_string(image)
-                    extracted_text += page_text + "\n\n"
-
-                # Clean up temporary file
-                os.unlink(temp_input_path)
-
+                extracted_text = await asyncio.to_thread(ocr_pdf, file_bytes)
             except Exception as ocr_error:
                 print(f"OCR failed: {str(ocr_error)}")
-                if os.path.exists(temp_input_path):
-                    os.unlink(temp_input_path)
                 extracted_text = ""
 
-        # 3. If both failed, try PyPDF2 as last resort
+        # 3. If both failed, read the PDF text layer directly as last resort
         if not extracted_text.strip():
-            print("Attempting PyPDF2 extraction...")
+            print("Attempting PyMuPDF extraction...")
             try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                    temp_file.write(file_bytes)
-                    temp_file_path = temp_file.name
-                
-                with open(temp_file_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    for page in pdf_reader.pages:
-                        try:
-                            extracted_text += page.extract_text() + "\n"
-                        except Exception as page_error:
-                            print(f"Error on page: {str(page_error)}")
-                
-                os.unlink(temp_file_path)
+                _, extracted_text = await extract_pdf_text(file_bytes)
             except Exception as pdf_error:
-                print(f"PyPDF2 failed: {str(pdf_error)}")
+                print(f"PyMuPDF failed: {str(pdf_error)}")
 
         # Store successfully extracted text
         if extracted_text and extracted_text.strip():
-            document.extracted_text = extracted_text
+            db.query(Document)\
+                .filter(Document.id == file_id)\
+                .update({"extracted_text": extracted_text}, synchronize_session=False)
             db.commit()
             print("Successfully stored extracted text")
             return {"text": extracted_text}
@@ -524,15 +777,20 @@ async def download_file(file_id: str, db: Session = Depends(get_db)):
         if not document:
             raise HTTPException(status_code=404, detail="File not found")
 
-        s3_key = document.s3_url.split(f"{settings.S3_BUCKET_NAME}.s3.amazonaws.com/")[1]
+        s3_key = document_s3_key(document.s3_key, document.s3_url)
         
         try:
-            response = s3_client.get_object(Bucket=settings.S3_BUCKET_NAME, Key=s3_key)
+            response = await asyncio.to_thread(
+                s3_client.get_object, Bucket=settings.S3_BUCKET_NAME, Key=s3_key
+            )
+            # StreamingBody iterates in 1 KiB pieces by default, each pulled
+            # through the threadpool; hand out 1 MiB chunks instead
             return StreamingResponse(
-                response['Body'],
+                response['Body'].iter_chunks(S3_STREAM_CHUNK_SIZE),
                 media_type='application/octet-stream',
                 headers={
-                    'Content-Disposition': f'attachment; filename="{document.filename}"'
+                    'Content-Disposition': f'attachment; filename="{document.filename}"',
+                    'Content-Length': str(response['ContentLength'])
                 }
             )
         except Exception as e:
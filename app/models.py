@@ -1,13 +1,23 @@
-from sqlalchemy import Column, String, DateTime, Text, JSON
+from sqlalchemy import Column, String, DateTime, Text, JSON, Index
 from datetime import datetime
 import uuid
 from .database import Base
 
 class Document(Base):
     __tablename__ = "documents"
+    # Serve the case/visa filters of /documents/ and /cases/ together with their
+    # newest-first ordering from an index (Postgres scans btrees backwards for DESC)
+    __table_args__ = (
+        Index("ix_documents_case_id_uploaded_at", "case_id", "uploaded_at"),
+        Index("ix_documents_case_id_visa_type_uploaded_at", "case_id", "visa_type", "uploaded_at"),
+        Index("ix_documents_uploaded_at", "uploaded_at"),
+        # Duplicate-upload lookup in /upload/
+        Index("ix_documents_case_id_content_sha256", "case_id", "content_sha256"),
+    )
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     filename = Column(String, index=True)
     s3_url = Column(String)
+    s3_key = Column(String, index=True)  # Object key in S3_BUCKET_NAME; NULL for rows that predate it
     case_id = Column(String, index=True)
     visa_type = Column(String, index=True)
     category = Column(String, index=True)
@@ -15,4 +25,5 @@ class Document(Base):
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     document_metadata = Column(JSON, nullable=True)  # Changed from metadata to document_metadata
     document_type = Column(String, index=True)
-    relevant_sections = Column(JSON, nullable=True)
\ No newline at end of file
+    relevant_sections = Column(JSON, nullable=True)
+    content_sha256 = Column(String(64), nullable=True)  # Hex digest of the uploaded bytes
\ No newline at end of file
@@ -5,14 +5,21 @@ LLM Client Service for OpenAI Integration
 import os
 import json
 import logging
-from typing import Dict, Any, Optional, List
+from typing import AsyncIterator, Dict, Any, Optional, List
 import httpx
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _is_retryable(exc: BaseException) -> bool:
+    """Retry transport failures, rate limits and server errors, but not other client errors"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status_code = exc.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
 class OpenAIClient:
     """Client for OpenAI API integration"""
     
@@ -28,8 +35,16 @@ class OpenAIClient:
             logger.warning("No OpenAI API key provided. Set OPENAI_API_KEY environment variable.")
         
         self.base_url = "https://api.openai.com/v1"
+        # HTTP/2 multiplexes concurrent completions over shared connections;
+        # the larger pool covers callers that fan out many requests at once
         self.client = httpx.AsyncClient(
+            http2=True,
             timeout=60.0,  # 60 second timeout
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=50,
+                keepalive_expiry=30
+            ),
             headers={
                 "Authorization": f"Bearer {self.api_key}",
                 "Content-Type": "application/json"
@@ -37,6 +52,7 @@ class OpenAIClient:
         )
     
     @retry(
+        retry=retry_if_exception(_is_retryable),
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=2, max=10)
     )
@@ -103,6 +119,55 @@ class OpenAIClient:
             logger.error(f"Error generating text: {str(e)}")
             return f"Error generating response: {str(e)}"
     
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        system_message: str = "You are a helpful assistant specializing in immigration law.",
+        model: str = "gpt-3.5-turbo",
+        temperature: float = 0.3,
+        max_tokens: int = 2000
+    ) -> AsyncIterator[str]:
+        """
+        Stream a text response from the OpenAI API, yielding content deltas as they arrive
+        
+        Callers can show the first tokens without waiting for the full completion.
+        """
+        url = f"{self.base_url}/chat/completions"
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        
+        try:
+            async with self.client.stream("POST", url, json=payload) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                
+                # Server-sent events: one "data: {...}" line per chunk, then "data: [DONE]"
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    content = choices[0].get("delta", {}).get("content")
+                    if content:
+                        yield content
+        
+        except httpx.HTTPError as e:
+            logger.error(f"Error streaming from OpenAI API: {str(e)}")
+            if hasattr(e, 'response') and e.response:
+                logger.error(f"Response: {e.response.text}")
+            raise
+    
     async def close(self):
         """Close the HTTP client"""
         await self.client.aclose()
@@ -74,19 +74,12 @@ const DocumentIngestion = () => {
 
     const fetchExistingCases = async () => {
         try {
-            const response = await fetch('/documents/');
+            // Cases are grouped server-side, one row per case
+            const response = await fetch('/cases/');
             const data = await response.json();
-            const casesMap = data.reduce((acc, doc) => {
-                if (!acc[doc.case_id]) {
-                    acc[doc.case_id] = { id: doc.case_id, visaTypes: new Set() };
-                }
-                acc[doc.case_id].visaTypes.add(doc.visa_type);
-                return acc;
-            }, {});
-
-            const uniqueCases = Object.values(casesMap).map(c => ({
-                id: c.id,
-                visaTypes: Array.from(c.visaTypes)
+            const uniqueCases = data.map(c => ({
+                id: c.case_id,
+                visaTypes: c.visa_types
             }));
             setExistingCases(uniqueCases);
         } catch (error) {
@@ -0,0 +1,29 @@
+import sys
+sys.path.append('.')
+
+from app.ket_rag.atomic_memory import AtomicMemory
+
+
+def test_non_ascii_case_folding():
+    """Letters whose text case-folds onto a keyword stem classify instead of raising"""
+    memory = AtomicMemory()
+
+    # "ſ" (long s) folds to "s" under re.IGNORECASE but lowercases to itself,
+    # so "ſtudy" is not the "study" stem; "UNIVERSITY" still marks education
+    education_chunk = {"text": "Her ſtudy at the UNIVERSITY"}
+    # "K" (Kelvin sign) lowercases to ASCII "k", so "KNOWLEDGE" is the
+    # "knowledge" stem and skills gets this chunk, not the first-chunk fallback
+    skills_chunk = {"text": "Deep KNOWLEDGE of the field"}
+    mapping = memory.map_chunks_to_parts("background", [education_chunk, skills_chunk])
+    assert mapping["education"] == [education_chunk]
+    assert mapping["skills"] == [skills_chunk]
+
+    example = {"text": "İmpact of his ACHIEVEMENTS on the field"}
+    mapping = memory.map_letter_examples_to_parts("experience", [example])
+    assert mapping["achievements"] == [example]
+    assert mapping["impact"] == []
+
+
+if __name__ == "__main__":
+    test_non_ascii_case_folding()
+    print("✓ Non-ASCII letter text classified without errors")